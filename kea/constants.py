@@ -1,2 +1,7 @@
-
 h = 0.73
+
+# The BPASS metallicity codes and the metal mass fraction they stand for
+BPASS_metallicities = {"em5": 1e-5, "em4": 1e-4, "001": 0.001, "002": 0.002,
+                       "003": 0.003, "004": 0.004, "006": 0.006, "008": 0.008,
+                       "010": 0.010, "014": 0.014, "020": 0.020, "030": 0.030,
+                       "040": 0.040}
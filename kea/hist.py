@@ -3,10 +3,92 @@
 #
 # Author: Max Briel
 #
+import bisect
+import weakref
 import numpy as np
 import matplotlib.pyplot as plt
 
 
+class binning:
+    """Read-only bin edges with their derived quantities, shared by all
+    histograms on the same grid. Use :func:`getBinning` to get the shared
+    instance for a set of edges instead of creating one directly.
+
+    Parameters
+    ----------
+    edges : array
+        The bin edges
+
+    Attributes
+    ----------
+    edges : array
+        The bin edges
+    lower_edges : array
+        The lower edge of every bin
+    upper_edges : array
+        The upper edge of every bin
+    widths : array
+        The width of every bin
+    centers : array
+        The center of every bin
+    nr_bins : int
+        The number of bins
+
+    """
+    def __init__(self, edges):
+        self.edges = _readOnly(edges)
+        self.lower_edges = self.edges[:-1]
+        self.upper_edges = self.edges[1:]
+        self.widths = _readOnly(self.upper_edges - self.lower_edges)
+        self.centers = _readOnly((self.upper_edges + self.lower_edges)/2)
+        self.nr_bins = len(self.edges) - 1
+        # the edges as floats, for fast lookups of single values
+        self._edge_list = self.edges.tolist()
+
+    def __reduce__(self):
+        # unpickled binnings are shared again
+        return (getBinning, (np.array(self.edges),))
+
+
+# All binnings in use, by the bytes of their edges
+_binnings = weakref.WeakValueDictionary()
+
+
+def getBinning(edges):
+    """Returns the shared binning for the given edges, creating it if no
+    histogram uses these edges yet.
+
+    Parameters
+    ----------
+    edges : array
+        The bin edges
+
+    Returns
+    -------
+    binning
+        The read-only binning with these edges
+
+    """
+    edges = np.array(edges, dtype=float)
+    key = edges.tobytes()
+    out = _binnings.get(key)
+    if out is None:
+        out = binning(edges)
+        _binnings[key] = out
+    return out
+
+
+# The types handled by the scalar fast paths of histogram
+_scalar_types = (float, int, np.number)
+
+
+def _readOnly(array):
+    """Returns a read-only float copy of **array**."""
+    out = np.array(array, dtype=float)
+    out.flags.writeable = False
+    return out
+
+
 class histogram:
     """A histogram which can contains data and can be manipulated.
     Either **xlow**, **xup**, and **nr_bins** is given or **edges**
@@ -14,6 +96,9 @@ class histogram:
     As per any histogram, the upper edges are non inclusive, except for the
     last bin.
 
+    The binning is shared with all other histograms on the same grid, so a
+    histogram only stores its own values.
+
     Parameters
     ----------
     xlow : float
@@ -22,11 +107,13 @@ class histogram:
         upper bound
     nr_bins : int
         the number of bins
-    edges : array
-        An array with items defining the edges.
+    edges : array/binning
+        An array with items defining the edges, or a binning.
 
     Attributes
     ----------
+    _binning : binning
+        The shared, read-only binning of the histogram
     _xlow : float
         lower bound of the histogram
     _xup : float
@@ -41,26 +128,64 @@ class histogram:
         An array of the lower edges of the bins in the histogram
     upper_edges : array
         An array of the upper edges of the bins in the histogram
+    _cumulative : tuple of arrays
+        Lazily built cumulative tables used by **sum** and **integral**. They
+        are reset whenever **_values** is assigned, filled or changed with an
+        in-place operator, so the values should not be modified in place by
+        other means.
+
+    Histograms support +, -, * and / with numbers, arrays and histograms with
+    the same binning, and the in-place forms +=, -=, *= and /=, which reuse
+    the values array instead of allocating a new histogram.
 
     """
     def __init__(self,xlow=None, xup=None, nr_bins=None, edges=None):
         if xlow != None and xup != None and nr_bins != None:
-            self._xlow = xlow
-            self._xup = xup
-            self._nr_bins = nr_bins
-            self._bin_edges = np.linspace(xlow, xup, nr_bins+1)
+            self._binning = getBinning(np.linspace(xlow, xup, nr_bins+1))
+
+        elif isinstance(edges, binning):
+            self._binning = edges
 
         elif isinstance(edges, type([])) or isinstance(edges, type(np.array([]))):
-            self._xlow = edges[0]
-            self._xup = edges[-1]
-            self._nr_bins = len(edges)-1
-            self._bin_edges = np.array(edges)
+            self._binning = getBinning(edges)
         else:
             raise Exception("Not given the correct input")
 
         self._values = np.zeros(self._nr_bins)
-        self.lower_edges = self._bin_edges[:-1]
-        self.upper_edges = self._bin_edges[1:]
+
+    @property
+    def _values(self):
+        return self._content
+
+    @_values.setter
+    def _values(self, values):
+        # any write to the values makes the cumulative tables stale
+        self._content = values
+        self._cumulative = None
+
+    @property
+    def _xlow(self):
+        return self._binning.edges[0]
+
+    @property
+    def _xup(self):
+        return self._binning.edges[-1]
+
+    @property
+    def _nr_bins(self):
+        return self._binning.nr_bins
+
+    @property
+    def _bin_edges(self):
+        return self._binning.edges
+
+    @property
+    def lower_edges(self):
+        return self._binning.lower_edges
+
+    @property
+    def upper_edges(self):
+        return self._binning.upper_edges
 
     def __len__(self):
         return len(self._values)
@@ -71,19 +196,97 @@ class histogram:
     def __repr__(self):
         return f"The bins: {self._bin_edges}\n The values: {self._values}"
 
+    # make numpy arrays and scalars defer to the reflected operators below,
+    # instead of building an object array of histograms
+    __array_ufunc__ = None
+
+    def __add__(self, other):
+        return self._withValues(self._values + self._operand(other))
+
+    def __radd__(self, other):
+        # also makes sum() of a list of histograms work
+        return self._withValues(self._operand(other) + self._values)
+
+    def __sub__(self, other):
+        return self._withValues(self._values - self._operand(other))
+
+    def __rsub__(self, other):
+        return self._withValues(self._operand(other) - self._values)
+
     def __mul__(self, other):
-        out = self.copy()
-        out._values = self._values * other
-        return out
+        return self._withValues(self._values * self._operand(other))
+
+    def __rmul__(self, other):
+        return self._withValues(self._operand(other) * self._values)
 
     def __div__(self, other):
-        out = self.copy()
-        out._values = self._values / other
-        return out
+        return self._withValues(self._values / self._operand(other))
 
     def __truediv__(self, other):
-        out = self.copy()
-        out._values = self._values / other
+        return self._withValues(self._values / self._operand(other))
+
+    def __rtruediv__(self, other):
+        return self._withValues(self._operand(other) / self._values)
+
+    def __iadd__(self, other):
+        self._values = np.add(self._values, self._operand(other), out=self._values)
+        return self
+
+    def __isub__(self, other):
+        self._values = np.subtract(self._values, self._operand(other), out=self._values)
+        return self
+
+    def __imul__(self, other):
+        self._values = np.multiply(self._values, self._operand(other), out=self._values)
+        return self
+
+    def __idiv__(self, other):
+        return self.__itruediv__(other)
+
+    def __itruediv__(self, other):
+        self._values = np.divide(self._values, self._operand(other), out=self._values)
+        return self
+
+    def _operand(self, other):
+        """Returns the values to combine with this histogram, checking that
+        a histogram operand has the same binning.
+
+        Parameters
+        ----------
+        other : histogram/float/array
+            The other operand
+
+        Returns
+        -------
+        float/array
+            **other**, or the values of **other** if it is a histogram
+
+        """
+        if isinstance(other, histogram):
+            if other._binning is not self._binning and \
+                    not np.array_equal(other._bin_edges, self._bin_edges):
+                raise Exception("The histograms have different binnings")
+            return other._values
+        return other
+
+    def _withValues(self, values):
+        """Returns a histogram of the same class and binning with the given
+        values, without copying them.
+
+        Parameters
+        ----------
+        values : array
+            The values of the new histogram
+
+        Returns
+        -------
+        histogram
+            A histogram of the same type as this one
+
+        """
+        out = object.__new__(type(self))
+        out._binning = self._binning
+        out._values = values
         return out
 
     def copy(self):
@@ -92,16 +295,18 @@ class histogram:
         Returns
         -------
         histogram
-            An exact copy of the histogram
+            An exact copy of the histogram, with its own values
 
         """
-        out = histogram(xlow=self._xlow, xup=self._xup, nr_bins=self._nr_bins)
-        out._values = self._values
-        return out
+        return self._withValues(self._values.copy())
 
     def Fill(self, x, w=1):
         """ Fill the histogram with data.
 
+        All entries are placed with a single binary search over the bin edges
+        and accumulated in one pass, so filling *N* entries costs
+        O(N log(bins)). Entries on or below the lower bound end up in
+        the first bin, entries on or above the upper bound in the last bin.
 
         Parameters
         ----------
@@ -110,28 +315,37 @@ class histogram:
         w : float/array
             The weight of the entry of *N* entries to be added to the histogram.
         """
-        def f(f, g):
-            if f >= self._xup:
-                 self._values[self._nr_bins-1] += g
-            elif f <= self._xlow:
-                self._values[0] += g
-            else:
-                bin_nr = np.where(self.lower_edges <= f)[0][-1]
-                self._values[bin_nr] += g
-
-        if not isinstance(x, type(0.0)):
-            if isinstance(w, type(0.0)):
-                for i in range(0, len(x)):
-                    f(x[i], w)
-            elif len(x) != len(w):
-                raise Exception("weights needs to be as long as x")
-            else:
-                for i in range(0, len(x)):
-                    f(x[i], w[i])
-        else:
-            f(x, w)
+        x = np.asarray(x, dtype=float)
+        w = np.asarray(w, dtype=float)
+        if w.ndim != 0 and w.shape != x.shape:
+            raise Exception("weights needs to be as long as x")
+
+        bins = self._findBins(x).ravel()
+        weights = np.broadcast_to(w, x.shape).ravel()
+        self._values += np.bincount(bins, weights=weights, minlength=self._nr_bins)
         return None
 
+    def _findBins(self, x):
+        """Returns the bin numbers of all entries in **x**, with everything
+        outside of the range put into the first or last bin. NaN entries
+        have no bin and raise an Exception.
+
+        Parameters
+        ----------
+        x : float/array
+            The values to find the bin numbers for
+
+        Returns
+        -------
+        int/array
+            The bin number of each entry
+
+        """
+        if np.isnan(x).any():
+            raise Exception("x contains NaN values")
+        bins = np.searchsorted(self._bin_edges, x, side="right") - 1
+        return np.clip(bins, 0, self._nr_bins-1)
+
     def plot(self, *argv, **kwargs):
         """Plot the histogram. matplotlib.pyplot arguments can be passed on too
         """
@@ -189,7 +403,7 @@ class histogram:
             The width of the bin
 
         """
-        return self.upper_edges[i] - self.lower_edges[i]
+        return self._binning.widths[i]
 
     def getBinCenter(self, i):
         """Returns the center of the bin
@@ -205,28 +419,37 @@ class histogram:
             The center of bin *i*
 
         """
-        return (self.upper_edges[i] + self.lower_edges[i])/2
+        return self._binning.centers[i]
 
     def getBin(self, x):
         """Returns the bin number at value **x**
 
         Parameters
         ----------
-        x : float
+        x : float/array
             value where you want to know the bin number
 
         Returns
         -------
-        int
+        int/array
             The bin number
 
         """
-        if x < self._bin_edges[0] or x > self._bin_edges[-1]:
+        if isinstance(x, _scalar_types):
+            return self._scalarBin(x)
+        if np.any(x < self._bin_edges[0]) or np.any(x > self._bin_edges[-1]):
             raise Exception("x outside of range")
-        out = np.where(x >= self._bin_edges)[0][-1]
-        if out == self._nr_bins:
-            out = out-1
-        return out
+        return self._findBins(x)
+
+    def _scalarBin(self, x):
+        """:meth:`getBin` for a single value, with a bisection of the edges
+        as floats instead of array operations.
+        """
+        edges = self._binning._edge_list
+        # also rejects NaN
+        if not edges[0] <= x <= edges[-1]:
+            raise Exception("x outside of range")
+        return min(bisect.bisect_right(edges, x) - 1, self._binning.nr_bins - 1)
 
     def getBinEdges(self):
         """Returns the bin edges of the histogram
@@ -239,95 +462,215 @@ class histogram:
         """
         return self._bin_edges
 
+    def _getCumulative(self):
+        """Returns the bin widths and the cumulative sums of the bin contents
+        and of the bin contents times the bin widths. The tables are built on
+        the first request and dropped whenever the values of the histogram
+        are replaced or filled.
 
-    def sum(self, x1, x2):
-        """Performs a binwise summation between parameters **x1** and **x2**.
+        Returns
+        -------
+        tuple of arrays
+            The bin widths, the cumulative sum and the cumulative integral.
+            The cumulative arrays have length **_nr_bins** + 1 and start at 0.
 
+        """
+        if self._cumulative is None:
+            widths = self._binning.widths
+            self._cumulative = (widths,
+                                np.concatenate(([0.], np.cumsum(self._values))),
+                                np.concatenate(([0.], np.cumsum(self._values*widths))))
+        return self._cumulative
+
+    def _rangeQuery(self, x1, x2, integrate):
+        """Sum or integrate the histogram between **x1** and **x2** using the
+        cumulative tables. Partially covered bins are weighted by the covered
+        fraction of the bin.
 
         Parameters
         ----------
-        x1 : float
-            lower bound of the summation
-        x2 : float
-            upper bound of the summation
+        x1 : float/array
+            lower bound(s)
+        x2 : float/array
+            upper bound(s)
+        integrate : bool
+            If True, weight the bin contents by the bin widths
 
         Returns
         -------
-        float
-            The summation of the bins between **x1** and **x2**
+        float/array
+            The result for each pair of **x1** and **x2**
 
         """
-        if x1 >= x2:
+        if isinstance(x1, _scalar_types) and isinstance(x2, _scalar_types):
+            return self._scalarRangeQuery(x1, x2, integrate)
+        x1 = np.asarray(x1, dtype=float)
+        x2 = np.asarray(x2, dtype=float)
+        if np.any(x1 >= x2):
             raise Exception("x1 should be larger than x2")
-        if x1 < self._bin_edges[0]:
+        if np.any(x1 < self._bin_edges[0]):
             print("WARNING: lower limit is below lowest bin edge")
-        if x2 > self._bin_edges[-1]:
+        if np.any(x2 > self._bin_edges[-1]):
             print("WARNING: higher limit is above the highest bin edge")
         lower_bin = self.getBin(x1)
         upper_bin = self.getBin(x2)
-        if lower_bin == upper_bin:
-            bin_width = self.getBinWidth(lower_bin)
-            return self.getBinContent(lower_bin) * (x2 - x1) / bin_width
+
+        widths, cum_sum, cum_int = self._getCumulative()
+        lower_value = self._values[lower_bin]
+        upper_value = self._values[upper_bin]
+        if integrate:
+            cumulative = cum_int
+        else:
+            cumulative = cum_sum
+            lower_value = lower_value / widths[lower_bin]
+            upper_value = upper_value / widths[upper_bin]
+
+        # both bounds in the same bin, or a lower part, upper part and the
+        # full bins in between
+        total = np.where(lower_bin == upper_bin,
+                         lower_value * (x2 - x1),
+                         lower_value * (self.upper_edges[lower_bin] - x1)
+                         + upper_value * (x2 - self.lower_edges[upper_bin])
+                         + cumulative[upper_bin] - cumulative[np.minimum(lower_bin+1, upper_bin)])
+        return total[()]
+
+    def _scalarRangeQuery(self, x1, x2, integrate):
+        """:meth:`_rangeQuery` for a single pair of bounds, with plain
+        comparisons instead of array operations.
+        """
+        if x1 >= x2:
+            raise Exception("x1 should be larger than x2")
+        edges = self._binning._edge_list
+        if x1 < edges[0]:
+            print("WARNING: lower limit is below lowest bin edge")
+        if x2 > edges[-1]:
+            print("WARNING: higher limit is above the highest bin edge")
+        lower_bin = self._scalarBin(x1)
+        upper_bin = self._scalarBin(x2)
+
+        widths, cum_sum, cum_int = self._getCumulative()
+        lower_value = self._values[lower_bin]
+        if integrate:
+            cumulative = cum_int
         else:
-            total = 0
-            # get lower bin part
-            bin_width = self.getBinWidth(lower_bin)
-            total += self.getBinContent(lower_bin) * (self.upper_edges[lower_bin] - x1)/bin_width
+            cumulative = cum_sum
+            lower_value = lower_value / widths[lower_bin]
+        if lower_bin == upper_bin:
+            return lower_value * (x2 - x1)
 
-            # get upper bin part
-            bin_width = self.getBinWidth(upper_bin)
-            total += self.getBinContent(upper_bin) * (x2 - self.lower_edges[upper_bin])/bin_width
+        upper_value = self._values[upper_bin]
+        if not integrate:
+            upper_value = upper_value / widths[upper_bin]
+        return (lower_value * (edges[lower_bin+1] - x1)
+                + upper_value * (x2 - edges[upper_bin])
+                + cumulative[upper_bin] - cumulative[lower_bin+1])
 
-            # get the parts in between if they are there
-            if (lower_bin + 1) != upper_bin:
-                for i in range(lower_bin+1, upper_bin):
-                    total += self._values[i]
+    def sum(self, x1, x2):
+        """Performs a binwise summation between parameters **x1** and **x2**.
 
-            return total
+        Arrays of bounds can be given to perform many summations at once.
+
+        Parameters
+        ----------
+        x1 : float/array
+            lower bound of the summation
+        x2 : float/array
+            upper bound of the summation
+
+        Returns
+        -------
+        float/array
+            The summation of the bins between **x1** and **x2**
+
+        """
+        return self._rangeQuery(x1, x2, integrate=False)
 
     def integral(self, x1, x2):
         """Returns the integral of the histogram between **x1** and **x2**.
 
+        Arrays of bounds can be given to perform many integrations at once.
+
         Parameters
         ----------
-        x1 : float
+        x1 : float/array
             lower bound of the integration
-        x2 : float
+        x2 : float/array
             upper bound of the integration
 
         Returns
         -------
-        float
+        float/array
             The integral between **x1** and **x2**
 
         """
-        if x1 >= x2:
-            raise Exception("x1 should be larger than x2")
-        if x1 < self._bin_edges[0]:
-            print("WARNING: lower limit is below lowest bin edge")
-        if x2 > self._bin_edges[-1]:
-            print("WARNING: higher limit is above the highest bin edge")
-        lower_bin = self.getBin(x1)
-        upper_bin = self.getBin(x2)
-        if lower_bin == upper_bin:
-            bin_width = self.getBinWidth(lower_bin)
-            return self.getBinContent(lower_bin) * (x2 - x1)
-        else:
-            total = 0
-            # get lower bin part
-            bin_width = self.getBinWidth(lower_bin)
-            total += self.getBinContent(lower_bin) * (self.upper_edges[lower_bin] - x1)
+        return self._rangeQuery(x1, x2, integrate=True)
 
-            # get upper bin part
-            bin_width = self.getBinWidth(upper_bin)
-            total += self.getBinContent(upper_bin) * (x2 - self.lower_edges[upper_bin])
 
-            # get the parts in between if they are there
-            if (lower_bin + 1) != upper_bin:
-                for i in range(lower_bin+1, upper_bin):
-                    total += self._values[i] * self.getBinWidth(i)
+def sumHistograms(histograms, weights=None, out=None):
+    """Sum many histograms with the same binning into one, without a new
+    histogram per addition.
 
-            return total
+    Parameters
+    ----------
+    histograms : iterable of histograms
+        The histograms to add up
+    weights : array of floats
+        An optional weight for each histogram
+    out : histogram
+        The histogram to store the sum in, which may be one of
+        **histograms**. By default a new histogram of the type and binning
+        of the first histogram is returned.
+
+    Returns
+    -------
+    histogram
+        The (weighted) sum of the histograms, **out** if given
+
+    """
+    histograms = list(histograms)
+    if not histograms:
+        raise Exception("No histograms to sum")
+    if weights is None:
+        weights = np.ones(len(histograms))
+    elif len(weights) != len(histograms):
+        raise Exception("weights needs to be as long as histograms")
+
+    first = histograms[0]
+    for h in histograms[1:]:
+        first._operand(h)
+    if out is None:
+        out = first._withValues(np.zeros(first._nr_bins))
+    else:
+        out._operand(first)
+
+    # a histogram that is also out only scales the values already in place
+    total = out._values
+    own = sum(w for h, w in zip(histograms, weights) if h is out)
+    if own == 0:
+        total[:] = 0
+    elif own != 1:
+        total *= own
+
+    scratch = None
+    for h, w in zip(histograms, weights):
+        if h is out:
+            continue
+        if w == 1:
+            np.add(total, h._values, out=total)
+        else:
+            if scratch is None:
+                scratch = np.empty_like(total)
+            np.multiply(h._values, w, out=scratch)
+            np.add(total, scratch, out=total)
+    out._values = total
+    return out
+
+
+# The BPASS age grid, computed once and shared by all BPASS histograms
+_BPASS_log_bins = _readOnly(np.linspace(6, 11, 51))
+_BPASS_lin_bins = _readOnly(10**np.linspace(6, 11, 51))
+_BPASS_log_edges = _readOnly(np.linspace(5.95, 11.05, 52))
+_BPASS_binning = getBinning(np.concatenate(([0.0], 10**np.linspace(6.05, 11.05, 51)/1e9)))
 
 
 class BPASS_hist(histogram):
@@ -342,7 +685,7 @@ class BPASS_hist(histogram):
     """
 
     def __init__(self):
-        super().__init__(edges=self.getLinEdges())
+        super().__init__(edges=_BPASS_binning)
 
     def Fill(self, x, w=1,ty=None):
         """Adds data to the BPASS histogram. Data values should be in years
@@ -358,7 +701,7 @@ class BPASS_hist(histogram):
             If none is given, log is assumed.
         """
         if (ty == "log") or (ty == None):
-            x = 10**x /1e9
+            x = np.power(10., x) /1e9
 
         histogram.Fill(self, x, w)
 
@@ -368,14 +711,14 @@ class BPASS_hist(histogram):
 
         Parameters
         ----------
-        x1 : float
+        x1 : float/array
             lower bound of the integration
-        x2 : float
+        x2 : float/array
             upper bound of the integration
 
         Returns
         -------
-        float
+        float/array
             The integral between **x1** and **x2**
 
         """
@@ -403,10 +746,10 @@ class BPASS_hist(histogram):
         Returns
         -------
         array
-            The middle points of all bins in logarithmic space
+            The middle points of all bins in logarithmic space. The array is shared and read-only.
 
         """
-        return np.linspace(6,11,51)
+        return _BPASS_log_bins
 
     def getLinBins(self):
         """Returns the middle points of all bins, except the first bin, which
@@ -415,10 +758,10 @@ class BPASS_hist(histogram):
         Returns
         -------
         array
-            The middle points of all bins in linear space
+            The middle points of all bins in linear space. The array is shared and read-only.
 
         """
-        return 10**np.linspace(6, 11, 51)
+        return _BPASS_lin_bins
 
     def getLogEdges(self):
         """Returns the edges in logarithmic space, except for the first bin,
@@ -427,10 +770,10 @@ class BPASS_hist(histogram):
         Returns
         -------
         array
-            The bin edges in logarithmic space
+            The bin edges in logarithmic space. The array is shared and read-only.
 
         """
-        return np.linspace(5.95, 11.05, 52)
+        return _BPASS_log_edges
 
 
     def getLinEdges(self):
@@ -440,22 +783,248 @@ class BPASS_hist(histogram):
         Returns
         -------
         array
-            The bin edges in linear space
+            The bin edges in linear space. The array is shared and read-only.
 
         """
-        x = [0.0]
-        x.extend(10**np.linspace(6.05, 11.05, 51)/1e9)
-        return x
+        return _BPASS_binning.edges
+
+
+class histogramND:
+    """An N-dimensional histogram, e.g. to bin the star formation rate in
+    lookback time and metallicity at the same time.
+
+    As for the 1-D histogram, the upper edges are non inclusive, except for
+    the last bin, and entries outside of the range end up in the first or
+    last bin of an axis.
+
+    Parameters
+    ----------
+    edges : array of arrays
+        The bin edges of each axis. An axis can also be given as a tuple
+        (xlow, xup, nr_bins) for linear binning.
+
+    Attributes
+    ----------
+    _axes : array of histograms
+        A 1-D histogram per axis, holding the binning of the axis
+    _values : array
+        An array of shape **shape** with the value of each bin
+
+    """
+    # The number of entries binned at once by Fill, to bound the memory use
+    _chunk_size = 1 << 22
+
+    def __init__(self, edges):
+        self._axes = []
+        for axis in edges:
+            if isinstance(axis, tuple):
+                self._axes.append(histogram(*axis))
+            else:
+                self._axes.append(histogram(edges=np.asarray(axis, dtype=float)))
+        self._values = np.zeros(self.shape)
+
+    @property
+    def shape(self):
+        """The number of bins along each axis"""
+        return tuple(i.getNBins() for i in self._axes)
+
+    @property
+    def ndim(self):
+        """The number of axes"""
+        return len(self._axes)
+
+    def __repr__(self):
+        return f"The shape: {self.shape}\n The values: {self._values}"
 
     def copy(self):
-        """Create a copy of the BPASS histogram
+        """ creates a copy of the histogram
+
+        Returns
+        -------
+        histogramND
+            A copy of the histogram with its own values
+
+        """
+        out = histogramND([i.getBinEdges() for i in self._axes])
+        out._values = self._values.copy()
+        return out
+
+    def Fill(self, *x, w=1):
+        """ Fill the histogram with data, one array of *N* entries per axis.
+
+        The entries are binned with one binary search per axis and
+        accumulated in a single pass, in chunks to bound the memory use.
+
+        Parameters
+        ----------
+        x : arrays
+            The coordinates of the entries, one float/array per axis
+        w : float/array
+            The weight of the entry of *N* entries to be added to the histogram.
+        """
+        if len(x) != self.ndim:
+            raise Exception(f"Expected {self.ndim} coordinates, got {len(x)}")
+        x = [np.ravel(np.asarray(i, dtype=float)) for i in x]
+        w = np.asarray(w, dtype=float)
+        nr_entries = len(x[0])
+        if any(len(i) != nr_entries for i in x):
+            raise Exception("All coordinates need to be as long as each other")
+        if w.ndim != 0 and w.size != nr_entries:
+            raise Exception("weights needs to be as long as x")
+        w = np.ravel(w)
+
+        counts = np.zeros(self._values.size)
+        for start in range(0, nr_entries, self._chunk_size):
+            end = start + self._chunk_size
+            bins = [axis._findBins(i[start:end]) for axis, i in zip(self._axes, x)]
+            flat = np.ravel_multi_index(bins, self.shape)
+            weights = w if w.size == 1 else w[start:end]
+            counts += np.bincount(flat, weights=np.broadcast_to(weights, flat.shape),
+                                  minlength=self._values.size)
+        self._values += counts.reshape(self.shape)
+        return None
+
+    def getValues(self):
+        """Return the values of the histogram
+
+        Returns
+        -------
+        array
+            The values stored in the histogram, with shape **shape**
+
+        """
+        return self._values
+
+    def getBinEdges(self, axis):
+        """Returns the bin edges of an axis
+
+        Parameters
+        ----------
+        axis : int
+            The axis number
 
         Returns
         -------
-        BPASS_hist
-            A copy of the BPASS historam.
+        array
+            An array of all the bin edges of the axis
+
         """
+        return self._axes[axis].getBinEdges()
+
+    def getSlice(self, axis, bins=None):
+        """Returns a 1-D histogram along **axis**, at the given bins of the
+        other axes.
+
+        Parameters
+        ----------
+        axis : int
+            The axis of the returned histogram
+        bins : array
+            The bin number for each of the other axes, in order. An entry of
+            None sums over that axis. By default all other axes are summed.
 
-        out = BPASS_hist()
-        out._values = self._values
+        Returns
+        -------
+        histogram
+            A histogram with the binning of **axis**
+
+        """
+        if bins is None:
+            bins = [None]*(self.ndim-1)
+        if len(bins) != self.ndim-1:
+            raise Exception(f"Expected {self.ndim-1} bins for the other axes")
+        index = list(bins)
+        index.insert(axis, slice(None))
+        values = self._values[tuple(slice(None) if i is None else i for i in index)]
+
+        # sum over the remaining other axes
+        remaining = [n for n, i in enumerate(index) if i is None or isinstance(i, slice)]
+        values = values.sum(axis=tuple(n for n, i in enumerate(remaining) if i != axis))
+
+        out = histogram(edges=self.getBinEdges(axis))
+        out._values = np.array(values, dtype=float)
         return out
+
+    def project(self, axis):
+        """Returns the projection of the histogram onto **axis**, summing
+        over all other axes.
+
+        Parameters
+        ----------
+        axis : int
+            The axis to project on
+
+        Returns
+        -------
+        histogram
+            A histogram with the binning of **axis**
+
+        """
+        return self.getSlice(axis)
+
+    def _rangeQuery(self, ranges, integrate):
+        """Sum or integrate the histogram over a range on every axis.
+
+        Parameters
+        ----------
+        ranges : array of tuples
+            The range (x1, x2) of every axis, or None for the full axis
+        integrate : bool
+            If True, weight the bin contents by the covered bin widths,
+            otherwise by the covered fraction of the bins
+
+        Returns
+        -------
+        float
+            The result over the range
+
+        """
+        if len(ranges) != self.ndim:
+            raise Exception(f"Expected {self.ndim} ranges")
+        out = self._values
+        for axis, limits in reversed(list(zip(self._axes, ranges))):
+            edges = axis.getBinEdges()
+            if limits is None:
+                x1, x2 = edges[0], edges[-1]
+            else:
+                x1, x2 = limits
+            if x1 >= x2:
+                raise Exception("x1 should be larger than x2")
+            covered = np.clip(np.minimum(x2, edges[1:]) - np.maximum(x1, edges[:-1]), 0, None)
+            if not integrate:
+                covered = covered / (edges[1:] - edges[:-1])
+            out = out @ covered
+        return out
+
+    def sum(self, ranges):
+        """Performs a binwise summation over a range on every axis. Bins
+        partially in the range are weighted by the covered fraction.
+
+        Parameters
+        ----------
+        ranges : array of tuples
+            The range (x1, x2) of every axis, or None for the full axis
+
+        Returns
+        -------
+        float
+            The summation of the bins in the range
+
+        """
+        return self._rangeQuery(ranges, integrate=False)
+
+    def integral(self, ranges):
+        """Returns the integral of the histogram over a range on every axis.
+
+        Parameters
+        ----------
+        ranges : array of tuples
+            The range (x1, x2) of every axis, or None for the full axis
+
+        Returns
+        -------
+        float
+            The integral over the range
+
+        """
+        return self._rangeQuery(ranges, integrate=True)
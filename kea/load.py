@@ -2,13 +2,33 @@
 # Functions to import data from BPASS
 #
 # Author: Max Briel
+import glob
 import gzip
+import hashlib
 import os
-from hoki import load
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import kea.hist
+from kea.profiling import span
+from kea.constants import BPASS_metallicities
 import pandas as pd
 import numpy as np
 
+# The columns of the BPASS supernova files, as named by hoki
+_SNe_columns = ['log_age', 'Ia', 'IIP', 'II', 'Ib', 'Ic', 'LGRB', 'PISNe', 'low_mass',
+                'e_Ia', 'e_IIP', 'e_II', 'e_Ib', 'e_Ic', 'e_LGRB', 'e_PISNe', 'e_low_mass',
+                'age_yrs']
+# The columns of the BPASS gravitational wave merger files
+_GW_columns = ["log_age", "BHBH", "BHNS", "NSNS", "age_yrs"]
+
+# Settings of the on-disk cache of the normalised rates, see setCache
+_cache_settings = {"folder": os.environ.get("KEA_CACHE_DIR",
+                                            os.path.join(os.path.expanduser("~"), ".cache", "kea")),
+                   "enabled": True}
+# Bump when the cached content changes, to invalidate old cache files
+_cache_version = 1
+
+
 def gunzip(source_filepath, dest_filepath, block_size=65536):
     """Unpacks a zipped file.
 
@@ -36,6 +56,10 @@ def gunzip(source_filepath, dest_filepath, block_size=65536):
 def packnload(file):
     """Load the data from a BPASS zipped file.
 
+    The file is decompressed while it is being parsed, so no uncompressed
+    copy is written to disk and the data folder can be read-only or shared
+    between concurrent jobs.
+
     Parameters
     ----------
     file : string
@@ -45,24 +69,155 @@ def packnload(file):
     -------
     pandas DataFrame
         A pandas DataFrame containing the model data from the BPASS file,
-        which is a *hoki* output.
+        with the same columns as the *hoki* output.
 
     """
-    gunzip(file+".gz", file)
-    out = load.model_output(file)
-    os.remove(file)
+    # the decompression is timed as part of the parsing, as it is streamed
+    with span("parse", unit="rows") as timer, gzip.open(file+".gz", "rt") as f:
+        out = pd.read_csv(f,
+                          sep=r"\s+",
+                          names=_SNe_columns,
+                          float_precision="round_trip")
+        timer.items = len(out)
     return out
 
 
-def loadBPASS(file, types):
+def setCache(folder=None, enabled=None):
+    """Configure the on-disk cache of the loaded BPASS rates.
+
+    By default the cache is enabled and lives in the folder given by the
+    environment variable ``KEA_CACHE_DIR`` or in ``~/.cache/kea``. Setting
+    ``KEA_CACHE_DIR`` to an empty string disables the cache.
+
+    Parameters
+    ----------
+    folder : string
+        The folder to store the cached rates in
+    enabled : bool
+        Enable or disable the cache
+    """
+    if folder is not None:
+        _cache_settings["folder"] = folder
+    if enabled is not None:
+        _cache_settings["enabled"] = enabled
+
+
+def clearCache(folder=None):
+    """Remove all cached rates, including temporary files left behind by
+    interrupted writes.
+
+    Parameters
+    ----------
+    folder : string
+        The cache folder to clear. By default the configured folder is used.
+
+    Returns
+    -------
+    int
+        The number of removed cache files
+    """
+    if folder is None:
+        folder = _cache_settings["folder"]
+    files = (glob.glob(os.path.join(folder, "rates-*.npz"))
+             + glob.glob(os.path.join(folder, "rates-*.tmp")))
+    for file in files:
+        os.remove(file)
+    return len(files)
+
+
+def _getCacheFolder(cache):
+    """Returns the cache folder to use for the **cache** argument of the load
+    functions, or None if the cache should not be used.
+    """
+    if isinstance(cache, str):
+        return cache
+    if cache and _cache_settings["enabled"] and _cache_settings["folder"]:
+        return _cache_settings["folder"]
+    return None
+
+
+def _cachedLoad(read, file, source, types, cache):
+    """Load rates from the cache or with **read** and store them in the cache.
+
+    The cache entry is identified by the path, size and modification time of
+    **source** and by the requested **types**, so changed files are reloaded.
+
+    Parameters
+    ----------
+    read : function
+        The function reading the rates as read(**file**, **types**)
+    file : string
+        The file argument of **read**
+    source : string
+        The file on disk the rates are read from
+    types : array of strings
+        The types of events to load
+    cache : bool or string
+        The cache argument of the load function
+
+    Returns
+    -------
+    dict of BPASS histograms
+        The rates as returned by **read**
+    """
+    folder = _getCacheFolder(cache)
+    if folder is None:
+        return read(file, types)
+
+    stat = os.stat(source)
+    key = repr((_cache_version, os.path.abspath(source), stat.st_size,
+                stat.st_mtime_ns, list(types)))
+    path = os.path.join(folder, "rates-"+hashlib.sha1(key.encode()).hexdigest()+".npz")
+
+    try:
+        with span("cache read"), np.load(path) as data:
+            rates = {}
+            for t in types:
+                rates[t] = kea.hist.BPASS_hist()
+                rates[t]._values = data[t]
+            return rates
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"WARNING: ignoring unreadable cache file {path}: {e}")
+
+    rates = read(file, types)
+    temporary = None
+    try:
+        os.makedirs(folder, exist_ok=True)
+        # write to a temporary file first, so concurrent loads never see
+        # a partially written cache entry
+        with tempfile.NamedTemporaryFile(dir=folder, prefix="rates-", suffix=".tmp",
+                                         delete=False) as f:
+            temporary = f.name
+            np.savez(f, **{t: rates[t].getValues() for t in types})
+        os.replace(temporary, path)
+        temporary = None
+    except OSError as e:
+        print(f"WARNING: could not write to the cache folder {folder}: {e}")
+    finally:
+        # a failed write leaves no partial file behind
+        if temporary is not None and os.path.exists(temporary):
+            os.remove(temporary)
+    return rates
+
+
+def loadBPASS(file, types, cache=True):
     """load BPASS rates.
 
+    The normalised rates are stored in the on-disk cache (see
+    :func:`setCache`), so the next load of the same, unchanged file only
+    reads the cached arrays.
+
     Parameters
     ----------
     file : string
         A string pointing to a file to be loaded
     types : array of strings
         An array of types of events to load from the BPASS file
+    cache : bool or string
+        Whether to use the on-disk cache. A string is used as the folder of
+        the cache instead of the configured one.
 
     Returns
     -------
@@ -71,35 +226,51 @@ def loadBPASS(file, types):
         from the file with an entry of each give type in **types**.
         The event rates are in #events/yr/:math:`M_\odot`.
 
+    """
+    return _cachedLoad(_readBPASS, file, file+".gz", types, cache)
+
+
+def _readBPASS(file, types):
+    """Read and normalise the BPASS rates of **types** from **file**,
+    see :func:`loadBPASS`.
     """
     SNe_rates = packnload(file)
     rates = {i:kea.hist.BPASS_hist() for i in types}
 
     val = list(rates.values())[0]
     log_bins = val.getLogBins()
-    for t in rates:
-        if t == "ccsn":
-            rates[t].Fill(log_bins, SNe_rates[["IIP", "II", "Ib", "Ic"]].sum(axis=1))
-        else:
-            rates[t].Fill(log_bins, SNe_rates[t].values)
+    with span("fill"):
+        for t in rates:
+            if t == "ccsn":
+                rates[t].Fill(log_bins, SNe_rates[["IIP", "II", "Ib", "Ic"]].sum(axis=1))
+            else:
+                rates[t].Fill(log_bins, SNe_rates[t].values)
 
     # normalise the rates to #Events/yr/M_sun
-    bin_widths = np.array([val.getBinWidth(i)*1e9 for i in range(0, val.getNBins())])
-    for i in rates:
-        rates[i] = rates[i]/1e6/bin_widths
+    with span("normalise"):
+        norm = 1e6*np.diff(val.getBinEdges())*1e9
+        for i in rates:
+            rates[i] /= norm
 
     return rates
 
 
-def loadGW(file, types):
+def loadGW(file, types, cache=True):
     """ Load the given **types** from the Graviational wave events file
 
+    The normalised rates are stored in the on-disk cache (see
+    :func:`setCache`), so the next load of the same, unchanged file only
+    reads the cached arrays.
+
     Parameters
     ----------
     file : string
         The path to a gravitational wave file from BPASS
     types : array of strings
         the type of events to extract from the file
+    cache : bool or string
+        Whether to use the on-disk cache. A string is used as the folder of
+        the cache instead of the configured one.
 
     Returns
     -------
@@ -109,25 +280,77 @@ def loadGW(file, types):
         The event rates are in #events/yr/:math:`M_\odot`.
 
     """
-    data = pd.read_csv(file,
-                    sep= "\s+",
-                    names=["log_age", "BHBH", "BHNS", "NSNS", "age_yrs"],
-                    engine="python")
+    return _cachedLoad(_readGW, file, file, types, cache)
+
+
+def _readGW(file, types):
+    """Read and normalise the gravitational wave rates of **types** from
+    **file**, see :func:`loadGW`.
+    """
+    for t in types:
+        if t not in _GW_columns:
+            raise Exception(f"Unknown gravitational wave event type {t}")
+
+    # only the requested columns are parsed
+    columns = [_GW_columns.index(t) for t in types]
+    with span("parse", unit="rows") as timer:
+        data = np.loadtxt(file, usecols=columns, ndmin=2)
+        timer.items = len(data)
     rates = {i:kea.hist.BPASS_hist() for i in types}
     val = list(rates.values())[0]
+    if len(data) != val.getNBins():
+        raise Exception(f"Expected {val.getNBins()} rows in {file}, but found {len(data)}")
+
     log_bins = val.getLogBins()
-    for i in rates:
-        rates[i].Fill(log_bins, data[i])
+    with span("fill"):
+        for n, i in enumerate(types):
+            rates[i].Fill(log_bins, data[:, n])
 
     # normalise the rates to #Events/yr/M_sun
-    bin_widths = np.array([val.getBinWidth(i)*1e9 for i in range(0, val.getNBins())])
-    for i in rates:
-        rates[i] = rates[i]/1e6/bin_widths
+    with span("normalise"):
+        norm = 1e6*np.diff(val.getBinEdges())*1e9
+        for i in rates:
+            rates[i] /= norm
 
     return rates
 
 
-def loadAllRates(data_folder):
+def _loadMetallicity(data_folder, metallicity, SNe_types, compact_types, cache=True):
+    """ Loads the SNe & compact merger rates for a single BPASS metallicity.
+
+    Parameters
+    ----------
+    data_folder : string
+        Folder containing the BPASS & GW models
+    metallicity : string
+        The BPASS metallicity code, e.g. "020"
+    SNe_types : array of strings
+        The supernova types to load
+    compact_types : array of strings
+        The compact merger types to load
+    cache : bool or string
+        The cache argument passed to :func:`loadBPASS` and :func:`loadGW`
+
+    Returns
+    -------
+    dict of BPASS histograms
+        A dictionary with an entry for each type in **SNe_types** and
+        **compact_types**.
+    """
+    SNe_file = data_folder+"bpass_v2.2.1_imf135_300/supernova-bin-imf135_300.z"+metallicity+".dat"
+    GW_file = data_folder+"GWrates/v2.2hobbs/gwmergerdata.z"+metallicity+".dat"
+
+    rates = {}
+    for load_func, file, types in [(loadBPASS, SNe_file, SNe_types),
+                                   (loadGW, GW_file, compact_types)]:
+        try:
+            rates.update(load_func(file, types, cache))
+        except Exception as e:
+            raise Exception(f"Could not load {file}: {type(e).__name__}: {e}") from e
+    return rates
+
+
+def loadAllRates(data_folder, workers=None, cache=True):
     """ Loads the SNe & compact merger rates for all available
     metallicities in BPASS
 
@@ -135,6 +358,11 @@ def loadAllRates(data_folder):
     ----------
     data_folder : string
         Folder containing the BPASS & GW models
+    workers : int
+        The number of processes to load the metallicities with. By default
+        all files are loaded one after another in the current process.
+    cache : bool or string
+        Whether to use the on-disk cache, see :func:`loadBPASS`.
 
     Returns
     -------
@@ -144,13 +372,30 @@ def loadAllRates(data_folder):
 
         The event rate are in #events/yr/:math:`M_\odot`.
     """
-    metallicities = ["em5", "em4", "001","002", "003", "004", "006", "008", "010", "014", "020", "030", "040"]
+    metallicities = list(BPASS_metallicities)
     SNe_types = ["ccsn", "Ia", "LGRB", "PISNe"]
     compact_types = ["BHBH", "BHNS", "NSNS"]
 
+    # resolve the cache folder here, so worker processes use the same cache
+    cache = _getCacheFolder(cache) or False
+
     rates = {}
-    for i in metallicities:
-        rates[i] = loadBPASS(data_folder+"bpass_v2.2.1_imf135_300/supernova-bin-imf135_300.z"+i+".dat", SNe_types)
-        rates[i].update(loadGW(data_folder+"GWrates/v2.2hobbs/gwmergerdata.z"+i+".dat", compact_types))
+    if workers is None or workers <= 1:
+        for i in metallicities:
+            rates[i] = _loadMetallicity(data_folder, i, SNe_types, compact_types, cache)
+        return rates
+
+    errors = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {i: pool.submit(_loadMetallicity, data_folder, i, SNe_types, compact_types, cache)
+                   for i in metallicities}
+        for i in metallicities:
+            try:
+                rates[i] = futures[i].result()
+            except Exception as e:
+                errors.append(f"z{i}: {e}")
 
+    if errors:
+        raise Exception("Failed to load the rates of {} metallicities:\n{}".format(
+                        len(errors), "\n".join(errors)))
     return rates
@@ -3,8 +3,14 @@
 # Also contains functions to extract data from the tree structure.
 #
 # Author: Max Briel
+import json
+import os
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
+from kea.profiling import span, printProgress
 
 class node():
     """A node class to build a tree structure.
@@ -72,13 +78,400 @@ class node():
         return getType(self)
 
 
-def getSFR(galaxy):
+class MergerForest():
+    """A collection of merger trees stored as NumPy arrays.
+
+    Every galaxy is a row in a set of columns, and the tree structure is kept
+    in index arrays, which makes the forest compact and fast to traverse.
+    :meth:`getNode` and :meth:`getRoots` hand out lightweight node-like views
+    for code written for :class:`node`.
+
+    Parameters
+    ----------
+    galaxyID : array
+        The identifier of each galaxy
+    parent : array
+        The index of the parent (descendant) of each galaxy, -1 for roots
+    columns : dict of arrays
+        The data of each galaxy, e.g. "snapnum" and "sfr"
+
+    Attributes
+    ----------
+    galaxyID : array
+        The identifier of each galaxy
+    columns : dict of arrays
+        The data of each galaxy
+    parent : array
+        The index of the parent of each galaxy, -1 for roots
+    first_child : array
+        The index of the first child of each galaxy, -1 without children
+    next_sibling : array
+        The index of the next child of the same parent, -1 for the last child
+    roots : array
+        The indices of the root galaxies, in the order of the rows
+
+    """
+    def __init__(self, galaxyID, parent, columns):
+        self.galaxyID = np.asarray(galaxyID)
+        self.parent = np.asarray(parent, dtype=np.int64)
+        self.columns = {i: np.asarray(columns[i]) for i in columns}
+        self._sorted = None
+        self._depth_root = None
+        self._preorder = None
+        self._nested_set = None
+
+        nr_nodes = len(self.galaxyID)
+        self.roots = np.flatnonzero(self.parent == -1)
+        self.first_child = np.full(nr_nodes, -1, dtype=np.int64)
+        self.next_sibling = np.full(nr_nodes, -1, dtype=np.int64)
+
+        # group the children by parent, keeping the row order within a group
+        children = np.flatnonzero(self.parent != -1)
+        children = children[np.argsort(self.parent[children], kind="stable")]
+        parents = self.parent[children]
+        same = parents[:-1] == parents[1:]
+        self.next_sibling[children[:-1][same]] = children[1:][same]
+        first = np.concatenate(([True], ~same)) if len(children) else np.array([], dtype=bool)
+        self.first_child[parents[first]] = children[first]
+
+    def __len__(self):
+        return len(self.galaxyID)
+
+    def getIndex(self, galaxyID):
+        """Returns the index of the galaxies with the given galaxyIDs
+
+        Parameters
+        ----------
+        galaxyID : int/array
+            One or more galaxyIDs
+
+        Returns
+        -------
+        int/array
+            The index of each galaxy in the forest
+
+        """
+        if self._sorted is None:
+            self._sorted = np.argsort(self.galaxyID, kind="stable")
+        sorted_IDs = self.galaxyID[self._sorted]
+        pos = np.clip(np.searchsorted(sorted_IDs, galaxyID), 0, len(self)-1)
+        if np.any(sorted_IDs[pos] != galaxyID):
+            raise Exception("galaxyID not in the forest")
+        return self._sorted[pos]
+
+    def getChildren(self, i):
+        """Returns the indices of the children of galaxy **i**
+
+        Parameters
+        ----------
+        i : int
+            The index of the galaxy
+
+        Returns
+        -------
+        array
+            The indices of the children
+
+        """
+        out = []
+        child = self.first_child[i]
+        while child != -1:
+            out.append(child)
+            child = self.next_sibling[child]
+        return np.array(out, dtype=np.int64)
+
+    def getNode(self, i):
+        """Returns a node-like view of galaxy **i**
+
+        Parameters
+        ----------
+        i : int
+            The index of the galaxy
+
+        Returns
+        -------
+        forestNode
+            A view on the galaxy in the forest
+
+        """
+        return forestNode(self, int(i))
+
+    def getRoots(self):
+        """Returns node-like views of all root galaxies, like the output of
+        :func:`buildHistory`.
+
+        Returns
+        -------
+        array
+            An array of forestNodes of the galaxies present in the now.
+
+        """
+        return [forestNode(self, int(i)) for i in self.roots]
+
+    def _getDepthAndRoot(self):
+        """Returns the depth and the root index of every galaxy, found by
+        pointer jumping, so it takes log(depth) vectorized steps.
+
+        Returns
+        -------
+        tuple of arrays
+            The depth (0 for roots) and the index of the root of each galaxy
+
+        """
+        if self._depth_root is None:
+            ancestor = np.where(self.parent == -1, np.arange(len(self)), self.parent)
+            depth = (self.parent != -1).astype(np.int64)
+            while True:
+                jump = ancestor[ancestor]
+                if np.array_equal(jump, ancestor):
+                    break
+                depth += depth[ancestor]
+                ancestor = jump
+            self._depth_root = (depth, ancestor)
+        return self._depth_root
+
+    def getSFRs(self, subtrees=False, nr_snapshots=None):
+        """Returns the star formation rate against snapshot number of every
+        root galaxy, or of the subtree of every galaxy, in one pass over the
+        forest.
+
+        Parameters
+        ----------
+        subtrees : bool
+            If True, return the cumulative star formation rate of the subtree
+            of every galaxy instead of only for the root galaxies.
+        nr_snapshots : int
+            The number of snapshots. By default the highest snapnum + 1.
+
+        Returns
+        -------
+        numpy array
+            An array of shape (roots, **nr_snapshots**), in the order of
+            **roots**, or of shape (galaxies, **nr_snapshots**) for
+            **subtrees**.
+
+        """
+        with span("SFR histories", len(self), "nodes"):
+            snapnum = self.columns["snapnum"].astype(np.int64)
+            sfr = self.columns["sfr"]
+            if nr_snapshots is None:
+                nr_snapshots = int(snapnum.max()) + 1 if len(self) else 0
+            elif len(self) and (snapnum.max() >= nr_snapshots or snapnum.min() < 0):
+                raise Exception(f"snapnum has to be between 0 and nr_snapshots ({nr_snapshots})")
+            depth, root = self._getDepthAndRoot()
+
+            if not subtrees:
+                # label every galaxy with its root and sum per root and snapshot
+                label = np.searchsorted(self.roots, root)
+                out = np.bincount(label*nr_snapshots + snapnum, weights=sfr,
+                                  minlength=len(self.roots)*nr_snapshots)
+                return out.reshape(len(self.roots), nr_snapshots)
+
+            # add the deepest galaxies to their parents first, one level at a time
+            out = np.zeros((len(self), nr_snapshots))
+            out[np.arange(len(self)), snapnum] = sfr
+            for nodes in self._getLevels()[:0:-1]:
+                np.add.at(out, self.parent[nodes], out[nodes])
+            return out
+
+    def _getLevels(self):
+        """Returns the indices of the galaxies at each depth of the forest,
+        starting with the roots, in row order within each level.
+
+        Returns
+        -------
+        list of arrays
+            The galaxy indices per depth
+
+        """
+        depth, _ = self._getDepthAndRoot()
+        if len(self) == 0:
+            return []
+        order = np.argsort(depth, kind="stable")
+        levels = np.searchsorted(depth[order], np.arange(depth.max()+2))
+        return [order[levels[d]:levels[d+1]] for d in range(len(levels)-1)]
+
+    def _getPreorder(self):
+        """Returns the position of every galaxy in a depth-first (preorder)
+        traversal of all trees, with the trees in the order of **roots** and
+        the children in row order, and the size of the subtree of every
+        galaxy. Both are computed level by level without recursion.
+
+        Returns
+        -------
+        tuple of arrays
+            The preorder position and the subtree size of every galaxy
+
+        """
+        if self._preorder is None:
+            levels = self._getLevels()
+            size = np.ones(len(self), dtype=np.int64)
+            for nodes in levels[:0:-1]:
+                np.add.at(size, self.parent[nodes], size[nodes])
+
+            preorder = np.zeros(len(self), dtype=np.int64)
+            if levels:
+                preorder[self.roots] = np.cumsum(size[self.roots]) - size[self.roots]
+            for nodes in levels[1:]:
+                # siblings follow each other, each after the subtrees of the
+                # siblings before it
+                nodes = nodes[np.argsort(self.parent[nodes], kind="stable")]
+                parents = self.parent[nodes]
+                before = np.cumsum(size[nodes]) - size[nodes]
+                first = np.concatenate(([True], parents[1:] != parents[:-1]))
+                group_start = np.maximum.accumulate(np.where(first, np.arange(len(nodes)), 0))
+                before -= before[group_start]
+                preorder[nodes] = preorder[parents] + 1 + before
+            self._preorder = (preorder, size)
+        return self._preorder
+
+    def getNestedSet(self):
+        """Returns the nested set index of the forest. In a depth-first
+        ordering of all galaxies, the progenitors of galaxy *i* are exactly
+        the galaxies at positions **left[i]** + 1 to **right[i]**. The index
+        is built once per forest.
+
+        Returns
+        -------
+        left : array
+            The depth-first position of each galaxy
+        right : array
+            The depth-first position of the last progenitor of each galaxy,
+            equal to **left** for galaxies without progenitors
+        order : array
+            The galaxy index at each depth-first position
+
+        """
+        if self._nested_set is None:
+            preorder, size = self._getPreorder()
+            order = np.empty_like(preorder)
+            order[preorder] = np.arange(len(self))
+            self._nested_set = (preorder, preorder + size - 1, order)
+        return self._nested_set
+
+    def isProgenitor(self, progenitor, galaxy):
+        """Check if galaxies are progenitors of other galaxies in constant
+        time per pair. Arrays of indices are compared element-wise.
+
+        Parameters
+        ----------
+        progenitor : int/array
+            The index of the possible progenitor
+        galaxy : int/array
+            The index of the galaxy
+
+        Returns
+        -------
+        bool/array
+            True if **progenitor** is in the merger tree of **galaxy**
+
+        """
+        left, right, _ = self.getNestedSet()
+        pos = left[progenitor]
+        return (left[galaxy] < pos) & (pos <= right[galaxy])
+
+    def getProgenitors(self, i):
+        """Returns all progenitors of galaxy **i**, as a slice of the
+        depth-first ordering of the forest.
+
+        Parameters
+        ----------
+        i : int
+            The index of the galaxy
+
+        Returns
+        -------
+        array
+            The indices of all progenitors in depth-first order
+
+        """
+        left, right, order = self.getNestedSet()
+        return order[left[i]+1:right[i]+1]
+
+    @property
+    def nbytes(self):
+        """The memory used by the arrays of the forest in bytes"""
+        arrays = [self.galaxyID, self.parent, self.first_child, self.next_sibling]
+        return sum(i.nbytes for i in arrays) + sum(self.columns[i].nbytes for i in self.columns)
+
+
+class _nodeData(Mapping):
+    """A read-only dictionary view on the columns of a galaxy in a
+    MergerForest.
+    """
+    def __init__(self, forest, index):
+        self._forest = forest
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._forest.columns[key][self._index]
+
+    def __iter__(self):
+        return iter(self._forest.columns)
+
+    def __len__(self):
+        return len(self._forest.columns)
+
+
+class forestNode():
+    """A lightweight view on a galaxy in a MergerForest, with the same
+    attributes as :class:`node`.
+
+    Parameters
+    ----------
+    forest : MergerForest
+        The forest containing the galaxy
+    index : int
+        The index of the galaxy in the forest
+
+    """
+    __slots__ = ("forest", "index")
+
+    def __init__(self, forest, index):
+        self.forest = forest
+        self.index = index
+
+    def __eq__(self, other):
+        return (isinstance(other, forestNode) and other.forest is self.forest
+                and other.index == self.index)
+
+    def __hash__(self):
+        return hash((id(self.forest), self.index))
+
+    @property
+    def galaxyID(self):
+        return self.forest.galaxyID[self.index]
+
+    @property
+    def data(self):
+        return _nodeData(self.forest, self.index)
+
+    @property
+    def children(self):
+        return [forestNode(self.forest, int(i)) for i in self.forest.getChildren(self.index)]
+
+    @property
+    def parent(self):
+        parent = self.forest.parent[self.index]
+        return None if parent == -1 else forestNode(self.forest, int(parent))
+
+    @property
+    def type(self):
+        return getType(self)
+
+
+def getSFR(galaxy, nr_snapshots=64):
     """ Extract the stellar formation rate given a root node of a merger tree.
 
+    To get the star formation rates of all galaxies in a forest at once,
+    use :meth:`MergerForest.getSFRs`.
+
     Parameters
     ----------
     galaxy : node
         A node of a galaxy
+    nr_snapshots : int
+        The number of snapshots in the simulation
 
     Returns
     -------
@@ -86,12 +479,12 @@ def getSFR(galaxy):
         A numpy array of the stellar formation rate over time.
 
     """
-    sfr = np.zeros(64)
+    sfr = np.zeros(nr_snapshots)
 
     sfr[int(galaxy.data["snapnum"])] += galaxy.data["sfr"]
 
     for i in galaxy.children:
-        sfr += getSFR(i)
+        sfr += getSFR(i, nr_snapshots)
     return sfr
 
 
@@ -172,9 +565,15 @@ def getType(node):
         return 2
 
 
-def buildHistory(cosmological_model):
+def buildHistory(cosmological_model, verbose=True, progress=None):
     """Build the merger tree histories of galaxies existing today.
 
+    All nodes are created first and indexed by their galaxyID, after which
+    every node is attached to its descendant with a single lookup. The
+    construction is linear in the number of rows and does not depend on
+    the rows being in depth-first order. For large catalogs,
+    :func:`buildForest` builds the same trees as arrays and is much faster.
+
     Parameters
     ----------
     cosmological_model : pandas DataFrame
@@ -186,6 +585,11 @@ def buildHistory(cosmological_model):
         - hotGas
         - coldGas
         - descendantId
+    verbose : bool
+        Print the row number every 1000 rows, if no **progress** is given
+    progress : function
+        Called as progress(rows done, total rows) every 1000 rows and
+        when all rows are read, e.g. to update a progress bar.
 
     Returns
     -------
@@ -194,34 +598,380 @@ def buildHistory(cosmological_model):
         the merger history of the galaxy in its children.
 
     """
-    root = None
-    last = None
-    parent = None
+    if progress is None and verbose:
+        progress = printProgress
+    total = len(cosmological_model)
     root_list = []
-
-    keys = cosmological_model.keys()
-
-    for index, row in cosmological_model.iterrows():
-        if index % 1000 == 0:
-            print(index)
-        if (row["descendantId"] == -1):
-            root = node()
-            root.addData(row)
-            root_list.append(root)
-            last = root
-        else:
-            if (last.galaxyID == row["descendantId"]):
-                item = node()
-                item.addData(row)
-                item.addParent(last)
-                last.addChild(item)
-                last = item
+    nodes = []
+    index = {}
+
+    with span("tree build", total, "rows"):
+        for i, row in enumerate(cosmological_model.to_dict("records")):
+            if progress is not None and i % 1000 == 0:
+                progress(i, total)
+            item = node()
+            item.addData(row)
+            nodes.append(item)
+            index[item.galaxyID] = item
+        if progress is not None:
+            progress(total, total)
+
+        for item, descendant in zip(nodes, cosmological_model["descendantId"].values):
+            if descendant == -1:
+                root_list.append(item)
             else:
-                parent = findNode(row["descendantId"], root)
-                item = node()
-                item.addData(row)
+                parent = index.get(descendant)
+                if parent is None:
+                    raise Exception(f"Descendant {descendant} of galaxy {item.galaxyID} not found")
                 item.addParent(parent)
                 parent.addChild(item)
-                last = item
 
     return root_list
+
+
+def iterTreeBatches(chunks):
+    """Split a depth-first ordered catalog, read in chunks, into batches of
+    complete merger trees. A tree is complete as soon as the next root row
+    (descendantId == -1) appears, so every chunk gives one batch with all
+    trees completed in it and only the rows of the last, unfinished tree are
+    kept for the next chunk.
+
+    Parameters
+    ----------
+    chunks : iterable of pandas DataFrames
+        The catalog in consecutive chunks, e.g. from pandas.read_csv with a
+        chunksize.
+
+    Yields
+    ------
+    pandas DataFrame
+        The rows of one or more complete merger trees, starting with a root.
+
+    """
+    pending = []
+    for chunk in chunks:
+        roots = np.flatnonzero(chunk["descendantId"].to_numpy() == -1)
+        if len(roots) == 0 or (roots[-1] == 0 and not pending):
+            pending.append(chunk)
+            continue
+        last = roots[-1]
+        if last > 0:
+            pending.append(chunk.iloc[:last])
+        yield _joinTrees(pending)
+        pending = [chunk.iloc[last:]]
+    if pending:
+        yield _joinTrees(pending)
+
+
+def iterTrees(chunks):
+    """Split a depth-first ordered catalog, read in chunks, into its merger
+    trees, see :func:`iterTreeBatches`.
+
+    Parameters
+    ----------
+    chunks : iterable of pandas DataFrames
+        The catalog in consecutive chunks, e.g. from pandas.read_csv with a
+        chunksize.
+
+    Yields
+    ------
+    pandas DataFrame
+        The rows of a single merger tree, starting with its root.
+
+    """
+    for batch in iterTreeBatches(chunks):
+        roots = np.flatnonzero(batch["descendantId"].to_numpy() == -1)
+        for start, end in zip(roots, np.append(roots[1:], len(batch))):
+            yield batch.iloc[start:end].reset_index(drop=True)
+
+
+def _joinTrees(pieces):
+    """Join the chunk pieces of complete trees and check they start with a root."""
+    trees = pd.concat(pieces, ignore_index=True) if len(pieces) > 1 else pieces[0].reset_index(drop=True)
+    if trees["descendantId"].iloc[0] != -1:
+        raise Exception(f"Galaxy {trees['galaxyID'].iloc[0]} is not part of a tree, "
+                        "the catalog should start with a root and be depth-first ordered")
+    return trees
+
+
+def _buildBatch(batch, forest):
+    """Build the trees of a batch as a MergerForest or a list of roots."""
+    if forest:
+        return buildForest(batch)
+    return buildHistory(batch, verbose=False)
+
+
+def _iterBuiltBatches(batches, forest, workers):
+    """Build the batches in a pool of **workers** processes and yield the
+    results in the order of the batches. At most two batches per worker are
+    read ahead, so the memory use stays bounded.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.submit(_buildBatch, batch, forest))
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def streamHistory(chunks, sink, forest=False, workers=None):
+    """Build the merger trees of a catalog that is read in chunks and pass
+    them to **sink** as soon as they are complete. The memory use is
+    bounded by the size of a chunk and the largest tree instead of the size
+    of the catalog.
+
+    The complete trees of every chunk are built together, see
+    :func:`iterTreeBatches`.
+
+    Parameters
+    ----------
+    chunks : iterable of pandas DataFrames
+        The depth-first ordered catalog in consecutive chunks.
+    sink : function
+        Called with the root node of every complete tree, or with a
+        MergerForest of the trees completed in a chunk if **forest**.
+    forest : bool
+        Pass MergerForests instead of root nodes, e.g. to
+        :meth:`ForestWriter.write`.
+    workers : int
+        The number of processes to build the batches of trees with. The
+        trees are passed to **sink** in the same order as in a single
+        process, and **sink** is always called in the calling process.
+        Forests are much cheaper to send between processes than trees of
+        nodes, so use **forest** together with **workers**.
+
+    Returns
+    -------
+    int
+        The number of trees built
+
+    """
+    batches = iterTreeBatches(chunks)
+    if workers is not None and workers > 1:
+        results = _iterBuiltBatches(batches, forest, workers)
+    else:
+        results = (_buildBatch(batch, forest) for batch in batches)
+
+    nr_trees = 0
+    for trees in results:
+        if forest:
+            sink(trees)
+            nr_trees += len(trees.roots)
+        else:
+            for root in trees:
+                sink(root)
+                nr_trees += 1
+    return nr_trees
+
+
+def buildForest(cosmological_model):
+    """Build the merger trees of all galaxies as a MergerForest.
+
+    Parameters
+    ----------
+    cosmological_model : pandas DataFrame
+        A pandas DataFrame containing at least the galaxyID and descendantId
+        of each galaxy. All other columns are stored as galaxy data.
+
+    Returns
+    -------
+    MergerForest
+        The forest with the merger trees of all galaxies present in the now.
+
+    """
+    with span("forest build", len(cosmological_model), "rows"):
+        galaxyID = cosmological_model["galaxyID"].to_numpy()
+        descendant = cosmological_model["descendantId"].to_numpy()
+        columns = {i: cosmological_model[i].to_numpy() for i in cosmological_model.columns
+                   if i != "galaxyID"}
+
+        order = np.argsort(galaxyID, kind="stable")
+        sorted_IDs = galaxyID[order]
+        pos = np.clip(np.searchsorted(sorted_IDs, descendant), 0, len(galaxyID)-1)
+        found = sorted_IDs[pos] == descendant
+        is_root = descendant == -1
+        if np.any(~found & ~is_root):
+            missing = np.flatnonzero(~found & ~is_root)[0]
+            raise Exception(f"Descendant {descendant[missing]} of galaxy {galaxyID[missing]} not found")
+        parent = np.where(is_root, -1, order[pos])
+
+        return MergerForest(galaxyID, parent, columns)
+
+
+class ForestWriter():
+    """Write merger trees to a columnar forest folder, one MergerForest at a
+    time. Every property is stored as a raw binary array, with the galaxies
+    of each tree stored together in depth-first order, so the folder can be
+    opened with memory mapping and single trees can be read without loading
+    the rest (see :func:`loadForest` and :func:`loadTree`).
+
+    Use as a context manager or call :meth:`close` when done.
+
+    Parameters
+    ----------
+    folder : string
+        The folder to write the forest to. It is created if needed.
+
+    """
+    def __init__(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self._files = {}
+        self._dtypes = None
+        self._nr_galaxies = 0
+        self._offsets = [np.zeros(1, dtype=np.int64)]
+        self._root_IDs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, forest):
+        """Append all trees in a MergerForest to the folder.
+
+        Parameters
+        ----------
+        forest : MergerForest
+            The trees to write
+
+        """
+        arrays = {"galaxyID": forest.galaxyID, "parent": forest.parent}
+        arrays.update({"column."+i: forest.columns[i] for i in forest.columns})
+        if self._dtypes is None:
+            self._dtypes = {}
+            for i in arrays:
+                if arrays[i].dtype.kind not in "biuf":
+                    raise Exception(f"Cannot store the non-numeric column {i}")
+                self._dtypes[i] = arrays[i].dtype.str
+                self._files[i] = open(os.path.join(self.folder, i+".bin"), "wb")
+        elif set(arrays) != set(self._dtypes):
+            raise Exception("All forests should have the same columns")
+
+        # reorder the galaxies depth-first, so every tree is one slice
+        preorder, size = forest._getPreorder()
+        order = np.empty_like(preorder)
+        order[preorder] = np.arange(len(forest))
+        parent = forest.parent[order]
+        arrays["parent"] = np.where(parent == -1, -1, preorder[parent] + self._nr_galaxies)
+        for i in arrays:
+            if i != "parent":
+                arrays[i] = arrays[i][order]
+            np.ascontiguousarray(arrays[i], dtype=self._dtypes[i]).tofile(self._files[i])
+
+        self._offsets.append(self._nr_galaxies + np.cumsum(size[forest.roots]))
+        self._root_IDs.append(forest.galaxyID[forest.roots])
+        self._nr_galaxies += len(forest)
+
+    def close(self):
+        """Write the tree index and the description of the folder."""
+        for i in self._files:
+            self._files[i].close()
+        self._files = {}
+
+        root_IDs = np.concatenate(self._root_IDs) if self._root_IDs else np.zeros(0, dtype=np.int64)
+        tree_order = np.argsort(root_IDs, kind="stable")
+        index = {"tree_offsets": np.concatenate(self._offsets),
+                 "tree_ids": root_IDs[tree_order],
+                 "tree_numbers": tree_order}
+        for i in index:
+            index[i].astype(np.int64).tofile(os.path.join(self.folder, i+".bin"))
+
+        with open(os.path.join(self.folder, "forest.json"), "w") as f:
+            json.dump({"version": 1,
+                       "nr_galaxies": self._nr_galaxies,
+                       "nr_trees": len(root_IDs),
+                       "dtypes": self._dtypes or {}}, f, indent=1)
+
+
+def saveForest(forest, folder):
+    """Save a MergerForest to a columnar forest folder, see :class:`ForestWriter`.
+
+    Parameters
+    ----------
+    forest : MergerForest
+        The forest to save
+    folder : string
+        The folder to write the forest to
+
+    """
+    with ForestWriter(folder) as writer:
+        writer.write(forest)
+
+
+def _openForest(folder):
+    """Returns the description of a forest folder and a function to open
+    its arrays with memory mapping.
+    """
+    with open(os.path.join(folder, "forest.json")) as f:
+        info = json.load(f)
+
+    def open_array(name, dtype=np.int64, length=None):
+        if length is None:
+            length = info["nr_galaxies"]
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(os.path.join(folder, name+".bin"), dtype=dtype, mode="r", shape=(length,))
+    return info, open_array
+
+
+def loadForest(folder, mmap=True):
+    """Load a forest folder written by :func:`saveForest` or :class:`ForestWriter`.
+
+    Parameters
+    ----------
+    folder : string
+        The forest folder
+    mmap : bool
+        Memory map the galaxy properties instead of reading them into memory.
+        The tree structure is always built in memory.
+
+    Returns
+    -------
+    MergerForest
+        The forest with all trees, in depth-first order.
+
+    """
+    info, open_array = _openForest(folder)
+    arrays = {i: open_array(i, info["dtypes"][i]) for i in info["dtypes"]}
+    if not mmap:
+        arrays = {i: np.array(arrays[i]) for i in arrays}
+    if not arrays:
+        return MergerForest(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), {})
+    columns = {i[len("column."):]: arrays[i] for i in arrays if i.startswith("column.")}
+    return MergerForest(arrays["galaxyID"], arrays["parent"], columns)
+
+
+def loadTree(folder, galaxyID):
+    """Load the merger tree of a single root galaxy from a forest folder
+    without reading the other trees.
+
+    Parameters
+    ----------
+    folder : string
+        The forest folder
+    galaxyID : int
+        The galaxyID of the root of the tree
+
+    Returns
+    -------
+    MergerForest
+        A forest containing the single tree
+
+    """
+    info, open_array = _openForest(folder)
+    tree_ids = open_array("tree_ids", length=info["nr_trees"])
+    pos = np.searchsorted(tree_ids, galaxyID)
+    if pos == len(tree_ids) or tree_ids[pos] != galaxyID:
+        raise Exception(f"There is no tree with root galaxy {galaxyID}")
+    tree = open_array("tree_numbers", length=info["nr_trees"])[pos]
+    offsets = open_array("tree_offsets", length=info["nr_trees"]+1)
+    start, end = offsets[tree], offsets[tree+1]
+
+    arrays = {i: np.array(open_array(i, info["dtypes"][i])[start:end]) for i in info["dtypes"]}
+    parent = np.where(arrays["parent"] == -1, -1, arrays["parent"] - start)
+    columns = {i[len("column."):]: arrays[i] for i in arrays if i.startswith("column.")}
+    return MergerForest(arrays["galaxyID"], parent, columns)
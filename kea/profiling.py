@@ -0,0 +1,176 @@
+#
+# Lightweight timing spans, throughput counters and progress reporting
+#
+# Author: Max Briel
+#
+import json
+import os
+import time
+
+# Profiling is off unless enabled with enable() or the environment variable
+# KEA_PROFILE is set to a non-empty value other than "0"
+_settings = {"enabled": os.environ.get("KEA_PROFILE", "0") not in ("", "0")}
+# name -> [calls, seconds, items, unit]
+_spans = {}
+
+
+class _span:
+    """Times the enclosed block and adds it to the span **name**."""
+    __slots__ = ("name", "items", "unit", "start")
+
+    def __init__(self, name, items, unit):
+        self.name = name
+        self.items = items
+        self.unit = unit
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        entry = _spans.get(self.name)
+        if entry is None:
+            entry = _spans[self.name] = [0, 0., 0, self.unit]
+        entry[0] += 1
+        entry[1] += elapsed
+        if self.items is not None:
+            entry[2] += self.items
+        return False
+
+
+class _nullSpan:
+    """The span handed out while profiling is disabled. It does nothing."""
+    __slots__ = ()
+    items = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_null_span = _nullSpan()
+
+
+def enable(enabled=True):
+    """Enable or disable the profiling of kea.
+
+    Profiling can also be enabled by setting the environment variable
+    ``KEA_PROFILE=1`` before kea is imported. Spans in worker processes
+    (the **workers** option of some functions) are not recorded.
+
+    Parameters
+    ----------
+    enabled : bool
+        Enable or disable the profiling
+    """
+    _settings["enabled"] = bool(enabled)
+
+
+def isEnabled():
+    """Returns whether profiling is enabled."""
+    return _settings["enabled"]
+
+
+def reset():
+    """Remove all recorded spans."""
+    _spans.clear()
+
+
+def span(name, items=None, unit="items"):
+    """Time a block of code under the given **name**.
+
+    All blocks with the same name are accumulated. When profiling is
+    disabled a shared, empty context manager is returned, so an
+    instrumented block costs no more than this function call.
+
+    Parameters
+    ----------
+    name : string
+        The name of the stage, e.g. "parse" or "convolution"
+    items : int
+        The number of items processed in the block, used for the
+        throughput. Can also be set on the returned span inside the block.
+    unit : string
+        The name of the items, e.g. "rows" or "nodes"
+
+    Returns
+    -------
+    context manager
+        The span, with a settable **items** attribute
+
+    Examples
+    --------
+    >>> with span("tree build", len(catalog), "rows"):
+    ...     roots = buildHistory(catalog)
+    """
+    if not _settings["enabled"]:
+        return _null_span
+    return _span(name, items, unit)
+
+
+def getStats():
+    """Returns the recorded spans.
+
+    Returns
+    -------
+    dict
+        For every span a dictionary with the number of calls, the total
+        time in seconds and, if items were counted, the number of items,
+        their unit and the throughput in items per second.
+    """
+    stats = {}
+    for name, (calls, seconds, items, unit) in _spans.items():
+        stats[name] = {"calls": calls, "seconds": seconds}
+        if items:
+            stats[name]["items"] = items
+            stats[name]["unit"] = unit
+            stats[name]["rate"] = items/seconds if seconds > 0 else float("inf")
+    return stats
+
+
+def getReport(format="text"):
+    """Returns a summary of the recorded spans.
+
+    Parameters
+    ----------
+    format : string
+        Either "text" for a table or "json"
+
+    Returns
+    -------
+    string
+        The summary report
+    """
+    stats = getStats()
+    if format == "json":
+        return json.dumps(stats, indent=1)
+    if format != "text":
+        raise Exception(f"Unknown report format {format}")
+
+    lines = [f"{'span':24s} {'calls':>8s} {'total [s]':>12s} {'per call [ms]':>14s}  throughput"]
+    for name in sorted(stats, key=lambda i: -stats[i]["seconds"]):
+        s = stats[name]
+        line = f"{name:24s} {s['calls']:8d} {s['seconds']:12.4f} {s['seconds']/s['calls']*1e3:14.4f}"
+        if "rate" in s:
+            line += f"  {s['rate']:.4g} {s['unit']}/s"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def printProgress(done, total):
+    """The default progress callback, printing the number of processed items.
+
+    Parameters
+    ----------
+    done : int
+        The number of processed items
+    total : int
+        The total number of items
+    """
+    print(done)
@@ -3,14 +3,22 @@
 #
 # Author: Max Briel
 #
+import hashlib
+from collections import OrderedDict
 import numpy as np
 from kea.hist import histogram, BPASS_hist
-from scipy import interpolate
+from kea.constants import BPASS_metallicities
+from kea.profiling import span
+from scipy import interpolate, signal
 
-def getSFRD(cosmological_simulation, time_relations, length, h):
+def getSFRD(cosmological_simulation, time_relations, length, h, groupby=None):
     """Extracts the total star formation rate density from a cosmological model
     without taking the metallicity into account.
 
+    The star formation rates are summed per snapshot in a single pass over
+    the simulation. With **groupby**, they are summed per group as well,
+    e.g. per mass or galaxy type bin, in the same pass.
+
     Parameters
     ----------
     cosmological_simulation : pandas DataFrame
@@ -22,31 +30,386 @@ def getSFRD(cosmological_simulation, time_relations, length, h):
         the length of the simulation
     h : float
         the Hubble parameter
+    groupby : string/array
+        Optional column name(s) or array(s) with a group for every row of
+        **cosmological_simulation**, as accepted by pandas groupby.
 
     Returns
     -------
     numpy array
         An array with a length of 64 with the stellar formation rate.
+        With **groupby**, a dictionary with this array for every group.
+    """
+    snaps = time_relations["snapNum"].to_numpy().astype(np.int64)
+    volume = (length/h)**3
+
+    if groupby is None:
+        with span("SFRD", len(cosmological_simulation), "rows"):
+            snapnum = cosmological_simulation["snapnum"].to_numpy().astype(np.int64)
+            # rows outside the snapshots of time_relations are ignored
+            valid = (snapnum >= 0) & (snapnum <= snaps.max())
+            total = np.bincount(snapnum[valid],
+                                weights=cosmological_simulation["sfr"].to_numpy()[valid],
+                                minlength=snaps.max()+1)
+        return total[snaps]/volume
+
+    keys = groupby if isinstance(groupby, list) else [groupby]
+    with span("SFRD", len(cosmological_simulation), "rows"):
+        grouped = cosmological_simulation.groupby(keys + ["snapnum"], observed=True)["sfr"].sum()
+    table = grouped.unstack(level=-1, fill_value=0).reindex(columns=snaps, fill_value=0)
+    return {group: SFR/volume for group, SFR in zip(table.index, table.to_numpy())}
+
+
+def getMetallicitySFRD(cosmological_simulation, time_relations, length, h,
+                       metallicity="metallicity"):
+    """Extracts the star formation rate density per BPASS metallicity from a
+    cosmological model.
+
+    Every galaxy is assigned to the nearest BPASS metallicity (in log space)
+    and the star formation rates are summed per metallicity and snapshot in a
+    single pass. Galaxies with a NaN metallicity are left out with a warning.
+
+    Parameters
+    ----------
+    cosmological_simulation : pandas DataFrame
+        The cosmological simulation where to extract the SFR from. Needs to
+        contain a column with 'sfr' and 'snapnum'.
+    time_relations : pandas DataFrame
+        contains the relation between snapshot number (snapnum) and lookback time
+    length : float
+        the length of the simulation
+    h : float
+        the Hubble parameter
+    metallicity : string/array
+        The column with the (gas or stellar) metal mass fraction of each
+        galaxy, or an array with the metal mass fractions.
+
+    Returns
+    -------
+    dict of numpy arrays
+        The stellar formation rate density against snapshot (ordered as in
+        **time_relations**) for every BPASS metallicity code, e.g. "020".
+    """
+    if isinstance(metallicity, str):
+        metallicity = cosmological_simulation[metallicity]
+    Z_bin = _getMetallicityBin(np.asarray(metallicity, dtype=float))
+    nr_nan = np.count_nonzero(Z_bin < 0)
+    if nr_nan > 0:
+        print(f"WARNING: ignoring {nr_nan} galaxies with a NaN metallicity")
+
+    snaps = time_relations["snapNum"].to_numpy().astype(np.int64)
+    snapnum = cosmological_simulation["snapnum"].to_numpy().astype(np.int64)
+    nr_snaps = snaps.max() + 1
+    nr_Z = len(BPASS_metallicities)
+
+    with span("SFRD", len(cosmological_simulation), "rows"):
+        # rows outside the snapshots of time_relations are ignored, so they
+        # can not end up in the row of another metallicity
+        valid = (snapnum >= 0) & (snapnum < nr_snaps) & (Z_bin >= 0)
+        total = np.bincount(Z_bin[valid]*nr_snaps + snapnum[valid],
+                            weights=cosmological_simulation["sfr"].to_numpy()[valid],
+                            minlength=nr_Z*nr_snaps).reshape(nr_Z, nr_snaps)
+    SFRD = total[:, snaps]/((length/h)**3)
+    return {Z: SFRD[i] for i, Z in enumerate(BPASS_metallicities)}
+
+
+def _getMetallicityBin(metallicity):
+    """Returns the index of the nearest BPASS metallicity in log space for
+    every metal mass fraction. Zero or negative values go to the lowest
+    metallicity, NaN values have no metallicity and get index -1.
+
+    Parameters
+    ----------
+    metallicity : numpy array
+        The metal mass fractions
+
+    Returns
+    -------
+    numpy array
+        The index in **BPASS_metallicities** of every entry, -1 for NaN
+    """
+    log_Z = np.log10(np.array(list(BPASS_metallicities.values())))
+    boundaries = (log_Z[1:] + log_Z[:-1])/2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_metallicity = np.log10(np.where(metallicity > 0, metallicity, 0))
+    return np.where(np.isnan(metallicity), -1, np.searchsorted(boundaries, log_metallicity))
+
+
+class SFRHistory():
+    """A star formation rate history given by a spline, which can be
+    integrated over many bins at once.
+
+    The antiderivative of the spline is calculated once, so the mass formed
+    in every bin of a grid follows from a single spline evaluation at the bin
+    edges. The masses are cached per grid, so repeated calls with the same
+    **sampling_rate** and **now** cost nothing.
+
+    Parameters
+    ----------
+    SFR : scipy.interpolate spline function
+        A scipy.interpolate spline (from splrep) of the stellar formation
+        rates (in :math:`M/yr/Mpc^3`) against lookback time in yr.
+
+    Attributes
+    ----------
+    SFR : scipy.interpolate spline function
+        The spline of the stellar formation rates
     """
-    SFR = []
-    for i in time_relations["snapNum"]:
-        data = cosmological_simulation.loc[
-                                    cosmological_simulation["snapnum"] == i]
-        if len(data) == 0:
-            SFR.append(0)
-        else:
-            SFR.append(data["sfr"].values.sum())
-    return np.array(SFR)/((length/h)**3)
-
-
-def getEventRates(SFR, DTDs, sampling_rate, now):
+    # The number of grids to keep the bin masses of
+    _cache_size = 16
+
+    def __init__(self, SFR):
+        self.SFR = SFR
+        self._antiderivative = interpolate.splantider(SFR)
+        self._cache = {}
+
+    def integral(self, t1, t2):
+        """Returns the mass formed between lookback times **t1** and **t2**,
+        equal to scipy.interpolate.splint. Outside of the range of the
+        spline no stars are formed.
+
+        Parameters
+        ----------
+        t1 : float/array
+            lower bound of the integration in yr
+        t2 : float/array
+            upper bound of the integration in yr
+
+        Returns
+        -------
+        float/array
+            The mass formed (in :math:`M/Mpc^3`)
+        """
+        return (interpolate.splev(t2, self._antiderivative, ext=3)
+                - interpolate.splev(t1, self._antiderivative, ext=3))
+
+    def getBinMasses(self, edges):
+        """Returns the mass formed in every bin of a lookback time grid.
+
+        Parameters
+        ----------
+        edges : array
+            The lookback time bin edges in Gyr
+
+        Returns
+        -------
+        numpy array
+            The stellar mass formed in each bin (in :math:`M/Mpc^3`). The
+            array is shared with the cache and can not be modified.
+        """
+        edges = np.asarray(edges, dtype=float)
+        key = edges.tobytes()
+        if key not in self._cache:
+            if len(self._cache) >= self._cache_size:
+                self._cache.pop(next(iter(self._cache)))
+            cumulative = interpolate.splev(edges*1e9, self._antiderivative, ext=3)
+            mass = np.diff(cumulative)
+            mass.flags.writeable = False
+            self._cache[key] = mass
+        return self._cache[key]
+
+
+def _getBinMasses(SFR, edges):
+    """Integrate the star formation rate over every bin of the lookback time grid.
+
+    Parameters
+    ----------
+    SFR : scipy.interpolate spline function or SFRHistory
+        The stellar formation rates (in :math:`M/yr/Mpc^3`)
+    edges : array
+        The lookback time bin edges in Gyr
+
+    Returns
+    -------
+    numpy array
+        The stellar mass formed in each bin (in :math:`M/Mpc^3`)
+    """
+    if not isinstance(SFR, SFRHistory):
+        SFR = SFRHistory(SFR)
+    return SFR.getBinMasses(edges)
+
+
+class DTDCache():
+    """A least-recently-used cache of Delay Time Distributions resampled
+    onto delay grids.
+
+    Entries are keyed on the content (type, bin edges and values) of the
+    histogram and on the grid, so parameter scans that only change the star
+    formation rate reuse the resampled DTDs. The memory of the stored
+    arrays is bounded by **max_bytes**.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum number of bytes of resampled DTDs to keep
+
+    Attributes
+    ----------
+    max_bytes : int
+        The maximum number of bytes of resampled DTDs to keep
+    hits : int
+        The number of resamplings served from the cache
+    misses : int
+        The number of resamplings that had to be calculated
+    """
+    def __init__(self, max_bytes=64*2**20):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+
+    def resample(self, DTD, edges, grid_key=None):
+        """Returns the integral of **DTD** over every bin of a delay grid.
+
+        Parameters
+        ----------
+        DTD : histogram or BPASS_hist
+            The Delay Time Distribution
+        edges : array
+            The delay bin edges in Gyr
+        grid_key : bytes
+            The sha1 digest of **edges**, to avoid hashing the same grid for
+            many DTDs
+
+        Returns
+        -------
+        numpy array
+            The integral over each bin, for a BPASS_hist in
+            events per :math:`M_\\odot`. The array is shared with the cache
+            and can not be modified.
+        """
+        edges = np.asarray(edges, dtype=float)
+        if grid_key is None:
+            grid_key = hashlib.sha1(edges.tobytes()).digest()
+        content = hashlib.sha1(type(DTD).__name__.encode())
+        content.update(np.ascontiguousarray(DTD.getBinEdges(), dtype=float).tobytes())
+        content.update(np.ascontiguousarray(DTD.getValues(), dtype=float).tobytes())
+        key = (content.digest(), grid_key)
+
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        self.misses += 1
+        out = np.asarray(DTD.integral(edges[:-1], edges[1:]), dtype=float)
+        out.flags.writeable = False
+        self._entries[key] = out
+        self._nbytes += out.nbytes
+        while self._nbytes > self.max_bytes and self._entries:
+            _, removed = self._entries.popitem(last=False)
+            self._nbytes -= removed.nbytes
+        return out
+
+    def getStats(self):
+        """Returns the statistics of the cache.
+
+        Returns
+        -------
+        dict
+            The hits, misses, number of entries and bytes in use
+        """
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(self._entries), "bytes": self._nbytes}
+
+    def clear(self):
+        """Remove all entries and reset the statistics."""
+        self._entries.clear()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+# The cache used by the event rate calculations
+DTD_cache = DTDCache()
+
+
+def _getResponse(DTDs, edges):
+    """Integrate every Delay Time Distribution over the delay bins of a uniform
+    lookback time grid, using the DTD_cache.
+
+    Parameters
+    ----------
+    DTDs : dictionary of BPASS_hists
+        The Delay Time Distributions
+    edges : array
+        The uniform lookback time bin edges in Gyr, starting at 0
+
+    Returns
+    -------
+    numpy array
+        An array of shape (len(**DTDs**), number of bins) with the number
+        of events per :math:`M_\\odot` at a delay of 0, 1, 2, ... bins.
+    """
+    grid_key = hashlib.sha1(np.asarray(edges, dtype=float).tobytes()).digest()
+    return np.array([DTD_cache.resample(DTDs[d], edges, grid_key) for d in DTDs])
+
+
+# The maximum number of elements of a Hankel matrix block in _convolveRates
+_block_elements = 2**22
+
+
+def _convolveRates(response, mass, method="matrix"):
+    """Combine the DTD response of all types with the mass formed per bin.
+
+    The number of events in lookback bin *j* is
+    :math:`\\sum_k response[k] \\cdot mass[j+k]`, i.e. the mass formed *k* bins
+    before bin *j* multiplied by the events per mass at that delay.
+    Leading dimensions (e.g. metallicity) are broadcast, so many SFR
+    histories can be combined in one call.
+
+    Parameters
+    ----------
+    response : numpy array
+        The events per mass per delay bin, with shape (..., types, bins)
+    mass : numpy array
+        The mass formed in each lookback time bin, with shape (..., bins)
+    method : string
+        Either "matrix", which multiplies with the Hankel matrix of **mass**
+        built in blocks of columns, so at most **_block_elements** of it
+        (over all stacked histories) are in memory, or "fft", which uses an FFT convolution and is faster for
+        large numbers of bins.
+
+    Returns
+    -------
+    numpy array
+        The number of events per lookback bin, with shape (..., types, bins)
+    """
+    nr_bins = mass.shape[-1]
+    if method == "matrix":
+        padded = np.concatenate((mass, np.zeros(mass.shape[:-1] + (nr_bins-1,))), axis=-1)
+        out = np.empty(np.broadcast_shapes(response.shape[:-2], mass.shape[:-1])
+                       + response.shape[-2:])
+        # windows[..., j, k] = mass[..., j+k], the transposed Hankel matrix
+        # as a view. Blocks of output bins j over all stacked histories are
+        # copied to contiguous memory, so the products run through BLAS.
+        windows = np.lib.stride_tricks.sliding_window_view(padded, nr_bins, axis=-1)
+        block = max(1, _block_elements // (nr_bins * max(1, int(np.prod(mass.shape[:-1])))))
+        for start in range(0, nr_bins, block):
+            hankel = np.ascontiguousarray(windows[..., start:start+block, :])
+            out[..., start:start+block] = response @ hankel.swapaxes(-1, -2)
+        return out
+    elif method == "fft":
+        full = signal.fftconvolve(response, mass[..., np.newaxis, ::-1], axes=-1)
+        return full[..., nr_bins-1::-1]
+    else:
+        raise Exception("Unknown method, use 'matrix' or 'fft'")
+
+
+def getEventRates(SFR, DTDs, sampling_rate, now, method="matrix"):
     """ Calculates the events rates by combining BPASS models and the
     cosmological simulations.
 
+    The Delay Time Distributions are integrated over the lookback time grid
+    once per type and the event rates of all types are calculated with a
+    single convolution with the mass formed per bin.
+
     Parameters
     ----------
-    SFR : scipy.interpolate spline function
-        A scipy.interpolate spline of the stellar formation rates (in :math:`M/yr/Mpc^3`)
+    SFR : scipy.interpolate spline function or SFRHistory
+        A scipy.interpolate spline of the stellar formation rates (in :math:`M/yr/Mpc^3`).
+        Give an SFRHistory to reuse the integrated masses between calls.
     DTDs : dictionary of BPASS_hists
         The Delay Time Distributions extracted in BPASS ordered in a histogram
         based on the event type
@@ -54,36 +417,239 @@ def getEventRates(SFR, DTDs, sampling_rate, now):
         The sampling rate for the new histogram (number of bins)
     now : float
         The current age of the universe in Gyrs.
+    method : string
+        The convolution method, either "matrix" or "fft". "fft" is faster
+        for very high sampling rates.
 
     Returns
     -------
     dictionary of histograms
         A dictionary containing histograms with the event rates per event type
-        with units :math:`\#events/yr/Gpc^3`.
+        with units :math:`\\#events/yr/Gpc^3`.
 
     """
-    events = {i: histogram(0, now, sampling_rate) for i in DTDs}
-    item = list(events.values())[0]
+    item = histogram(0, now, sampling_rate)
     lookback = item.getBinEdges()
-    Nbins = item.getNBins()
-    mass = 0
 
+    with span("SFR integration", sampling_rate, "bins"):
+        mass = _getBinMasses(SFR, lookback)  # Total Mass/Mpc3 in bin
+    with span("DTD resampling", len(DTDs), "DTDs"):
+        response = _getResponse(DTDs, lookback)  # Events per M per delay bin
+    with span("convolution", sampling_rate*len(DTDs), "bins"):
+        counts = _convolveRates(response, mass, method)
+
+    # normalise to on a per yr basis, in place, and hand out views per type
+    counts /= (lookback[1:] - lookback[:-1])*1e9
+    return {d: item._withValues(counts[i]) for i, d in enumerate(DTDs)}
 
-    for i in range(1, Nbins+1):
-        t1 = lookback[i-1]
-        t2 = lookback[i]
-        mass = interpolate.splint(t1*1e9, t2*1e9, SFR)  # Total Mass/Mpc3 in bin
-        if mass == 0:
-            continue
-        for j in range(0, i):
-            p1 = t2 - lookback[j]
-            p2 = t2 - lookback[j+1]
-            for d in DTDs:
-                bin_events = DTDs[d].integral(p2, p1) # Event in the bin per M
-                events[d].Fill(lookback[j], bin_events*mass)
+
+def getMetallicityEventRates(SFRs, DTDs, sampling_rate, now, method="matrix"):
+    """ Calculates the event rates for star formation split over metallicity
+    by combining every metallicity bin with its own BPASS models.
+
+    All metallicities and event types are handled in one stacked
+    (metallicity x type x time) computation.
+
+    Parameters
+    ----------
+    SFRs : dictionary of scipy.interpolate spline functions or SFRHistories
+        The stellar formation rate (in :math:`M/yr/Mpc^3`) per metallicity,
+        with the BPASS metallicities as keys, e.g. "em5" or "020".
+    DTDs : dict["metallicity"]["event type"]
+        The Delay Time Distributions per metallicity and event type as given
+        by :func:`kea.load.loadAllRates`. All metallicities in **SFRs** have
+        to be present.
+    sampling_rate : int
+        The sampling rate for the new histogram (number of bins)
+    now : float
+        The current age of the universe in Gyrs.
+    method : string
+        The convolution method, either "matrix" or "fft".
+
+    Returns
+    -------
+    dictionary of histograms
+        The event rates per event type summed over all metallicities
+        with units :math:`\\#events/yr/Gpc^3`.
+    dict["metallicity"]["event type"]
+        The event rates per metallicity and event type.
+
+    """
+    metallicities = list(SFRs)
+    for Z in metallicities:
+        if Z not in DTDs:
+            raise Exception(f"No DTDs given for metallicity {Z}")
+    types = list(DTDs[metallicities[0]])
+
+    item = histogram(0, now, sampling_rate)
+    lookback = item.getBinEdges()
+
+    with span("SFR integration", sampling_rate*len(metallicities), "bins"):
+        mass = np.array([_getBinMasses(SFRs[Z], lookback) for Z in metallicities])
+    with span("DTD resampling", len(types)*len(metallicities), "DTDs"):
+        response = np.array([_getResponse({t: DTDs[Z][t] for t in types}, lookback)
+                             for Z in metallicities])
+    with span("convolution", sampling_rate*len(types)*len(metallicities), "bins"):
+        counts = _convolveRates(response, mass, method)
 
     # normalise to on a per yr basis
-    bins = np.array([item.getBinWidth(i)*1e9 for i in range(0, Nbins)])
-    for i in events:
-        events[i] = events[i]/bins
-    return events
+    counts /= (lookback[1:] - lookback[:-1])*1e9
+
+    events_per_Z = {}
+    for i, Z in enumerate(metallicities):
+        events_per_Z[Z] = {t: item._withValues(counts[i, j]) for j, t in enumerate(types)}
+
+    total = counts.sum(axis=0)
+    events = {t: item._withValues(total[j]) for j, t in enumerate(types)}
+
+    return events, events_per_Z
+
+
+def _getSnapshotMasses(time_relations, nr_snapshots, edges):
+    """Returns the matrix that integrates linearly interpolated star
+    formation histories over the bins of a lookback time grid.
+
+    The mass formed in each bin is linear in the star formation rates at
+    the snapshots, so for star formation rates **SFRs** of shape
+    (galaxies, **nr_snapshots**) the mass formed per bin is SFRs @ matrix.
+
+    Parameters
+    ----------
+    time_relations : pandas DataFrame
+        contains the relation between snapshot number (snapNum) and lookback time
+    nr_snapshots : int
+        The number of snapshots
+    edges : array
+        The lookback time bin edges in Gyr
+
+    Returns
+    -------
+    numpy array
+        An array of shape (**nr_snapshots**, bins). Snapshots missing from
+        **time_relations** have a row of zeros.
+    """
+    snaps = time_relations["snapNum"].to_numpy().astype(np.int64)
+    lookback = time_relations["lookbackTime"].to_numpy()*1e9
+    order = np.argsort(lookback)
+
+    out = np.zeros((nr_snapshots, len(edges)-1))
+    basis = np.zeros(len(order))
+    for i, s in enumerate(snaps[order]):
+        if s >= nr_snapshots:
+            continue
+        # the mass formed by a unit star formation rate at this snapshot only
+        basis[i] = 1
+        out[s] = SFRHistory(interpolate.splrep(lookback[order], basis, k=1)).getBinMasses(edges)
+        basis[i] = 0
+    return out
+
+
+def _getToeplitzBlocks(response):
+    """Yields the Toeplitz matrix of the DTD responses of all types in
+    blocks of output bins, with at most **_block_elements** per block.
+
+    Parameters
+    ----------
+    response : numpy array
+        The events per mass per delay bin, with shape (types, bins)
+
+    Yields
+    ------
+    int
+        The first output bin of the block
+    numpy array
+        The block, with shape (types x block bins, bins). Row (t, j) holds
+        the events of type t in output bin j per mass formed in each bin i,
+        response[t, i-j] for i >= j and 0 otherwise.
+    """
+    nr_types, nr_bins = response.shape
+    padded = np.concatenate((np.zeros((nr_types, nr_bins-1)), response), axis=-1)
+    # windows[t, a, i] = padded[t, a+i], so output bin j is window nr_bins-1-j
+    windows = np.lib.stride_tricks.sliding_window_view(padded, nr_bins, axis=-1)
+    block = max(1, _block_elements // (nr_types * nr_bins))
+    for start in range(0, nr_bins, block):
+        stop = min(start+block, nr_bins)
+        rows = windows[:, nr_bins-stop:nr_bins-start][:, ::-1]
+        yield start, np.ascontiguousarray(rows).reshape(-1, nr_bins)
+
+
+def getGalaxyEventRates(SFRs, time_relations, DTDs, sampling_rate, now,
+                        method="matrix", chunk_size=None, out=None):
+    """Calculates the event rates of many galaxies at once from their own
+    star formation histories, e.g. of every root galaxy of a merger forest.
+
+    The star formation history of every galaxy is linearly interpolated
+    between the snapshots, as a spline with k=1 given to
+    :func:`getEventRates`. The mass formed per bin of all galaxies is a
+    single matrix product. With the "matrix" method, the events of each
+    chunk of galaxies follow from one matrix product per block of the
+    Toeplitz matrix of the DTD responses (see :func:`_getToeplitzBlocks`),
+    with the "fft" method from :func:`_convolveRates`.
+
+    Parameters
+    ----------
+    SFRs : numpy array
+        The star formation rates (in :math:`M/yr`) of shape (galaxies,
+        snapshots), with the snapshots in order of snapnum, as given by
+        :meth:`kea.mergerHistory.MergerForest.getSFRs`.
+    time_relations : pandas DataFrame
+        contains the relation between snapshot number (snapNum) and lookback time
+    DTDs : dictionary of BPASS_hists
+        The Delay Time Distributions extracted in BPASS ordered in a histogram
+        based on the event type
+    sampling_rate : int
+        The sampling rate for the new histogram (number of bins)
+    now : float
+        The current age of the universe in Gyrs.
+    method : string
+        The convolution method, either "matrix" or "fft". "fft" is faster
+        for high sampling rates.
+    chunk_size : int
+        The number of galaxies to process at once. The intermediate arrays
+        grow linearly with **chunk_size** and the number of bins, so this
+        bounds the memory use. By default all galaxies are processed at once.
+    out : numpy array
+        An array of shape (galaxies, types, **sampling_rate**) to store the
+        result in, e.g. a numpy memmap for very large forests.
+
+    Returns
+    -------
+    numpy array
+        The event rates (in #events/yr) of shape (galaxies, types,
+        **sampling_rate**), with the types in the order of **DTDs** and the
+        bins of histogram(0, **now**, **sampling_rate**).
+
+    """
+    if method not in ("matrix", "fft"):
+        raise Exception("Unknown method, use 'matrix' or 'fft'")
+    SFRs = np.asarray(SFRs, dtype=float)
+    nr_galaxies = SFRs.shape[0]
+    lookback = histogram(0, now, sampling_rate).getBinEdges()
+    shape = (nr_galaxies, len(DTDs), sampling_rate)
+    if out is None:
+        out = np.empty(shape)
+    elif out.shape != shape:
+        raise Exception(f"out has shape {out.shape}, but {shape} is needed")
+    if chunk_size is None:
+        chunk_size = max(nr_galaxies, 1)
+
+    with span("SFR integration", SFRs.shape[1], "snapshots"):
+        snapshot_masses = _getSnapshotMasses(time_relations, SFRs.shape[1], lookback)
+    with span("DTD resampling", len(DTDs), "DTDs"):
+        response = _getResponse(DTDs, lookback)
+    bins = (lookback[1:] - lookback[:-1])*1e9
+
+    for start in range(0, nr_galaxies, chunk_size):
+        chunk = slice(start, min(start+chunk_size, nr_galaxies))
+        with span("convolution", chunk.stop-chunk.start, "galaxies"):
+            mass = SFRs[chunk] @ snapshot_masses
+            if method == "matrix":
+                for start, toeplitz in _getToeplitzBlocks(response):
+                    counts = mass @ toeplitz.T
+                    out[chunk, :, start:start+counts.shape[1]//len(DTDs)] = \
+                        counts.reshape(len(mass), len(DTDs), -1)
+                out[chunk] /= bins
+            else:
+                counts = _convolveRates(response[np.newaxis], mass, method)
+                np.divide(counts, bins, out=out[chunk])
+    return out
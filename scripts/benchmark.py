@@ -0,0 +1,281 @@
+"""
+A script to benchmark the hot paths of kea on synthetic data, so it runs
+offline without the BPASS models or a cosmological simulation.
+
+Synthetic BPASS supernova and gravitational wave files and a Millennium-style,
+depth-first ordered galaxy catalog of configurable size are generated in a
+temporary folder. The timings are written to a JSON file, which can be
+compared with an earlier run.
+
+Author: Max Briel
+"""
+
+import json
+import os
+import platform
+import tempfile
+import time
+import gzip
+
+import numpy as np
+import pandas as pd
+from scipy import interpolate
+
+import kea.hist
+import kea.load
+import kea.rates
+import kea.mergerHistory
+import kea.profiling
+from kea.constants import BPASS_metallicities
+
+import argparse
+
+
+def writeBPASS(data_folder, seed=0):
+    """Write synthetic BPASS supernova and gravitational wave files for all
+    metallicities, in the folder layout expected by kea.load.loadAllRates.
+
+    Parameters
+    ----------
+    data_folder : string
+        The folder to write the files to
+    seed : int
+        The seed of the random numbers
+    """
+    rng = np.random.default_rng(seed)
+    log_age = np.linspace(6, 11, 51)
+    os.makedirs(data_folder+"bpass_v2.2.1_imf135_300", exist_ok=True)
+    os.makedirs(data_folder+"GWrates/v2.2hobbs", exist_ok=True)
+
+    for Z in BPASS_metallicities:
+        # falling power laws with noise, switched on at a random age
+        SNe = 10**(4 - 0.8*(log_age[:, None] - 6) + rng.normal(0, 0.1, (51, 16)))
+        SNe *= log_age[:, None] > rng.uniform(6, 8, 16)
+        with gzip.open(data_folder+"bpass_v2.2.1_imf135_300/supernova-bin-imf135_300.z"+Z+".dat.gz", "wt") as f:
+            for age, row in zip(log_age, SNe):
+                f.write(f"{age:.2f} " + " ".join(f"{x:.6E}" for x in row) + f" {10**age:.6E}\n")
+
+        GW = 10**(2 - 0.5*(log_age[:, None] - 6) + rng.normal(0, 0.1, (51, 3)))
+        with open(data_folder+"GWrates/v2.2hobbs/gwmergerdata.z"+Z+".dat", "w") as f:
+            for age, row in zip(log_age, GW):
+                f.write(f"{age:.2f} " + " ".join(f"{x:.6E}" for x in row) + f" {10**age:.6E}\n")
+
+
+def makeCatalog(nr_galaxies, tree_size=100, seed=0):
+    """Generate a Millennium-style galaxy catalog of random merger trees,
+    in depth-first order.
+
+    Parameters
+    ----------
+    nr_galaxies : int
+        The total number of galaxies
+    tree_size : int
+        The number of galaxies per tree
+    seed : int
+        The seed of the random numbers
+
+    Returns
+    -------
+    pandas DataFrame
+        A catalog with galaxyID, descendantId, snapnum, sfr, stellarMass,
+        bulgeMass, hotGas, coldGas and metallicity columns.
+    """
+    rng = np.random.default_rng(seed)
+    index = np.arange(nr_galaxies)
+    local = index % tree_size
+    # every galaxy merges into a random earlier galaxy of the same tree
+    parent = np.where(local == 0, -1, index - local + (rng.random(nr_galaxies)*local).astype(np.int64))
+
+    forest = kea.mergerHistory.MergerForest(index, parent, {})
+    preorder, _ = forest._getPreorder()
+    depth, _ = forest._getDepthAndRoot()
+    order = np.empty_like(preorder)
+    order[preorder] = index
+
+    parent = parent[order]
+    catalog = pd.DataFrame({
+        "galaxyID": index,
+        "descendantId": np.where(parent == -1, -1, preorder[parent]),
+        "snapnum": np.clip(63 - depth[order], 0, 63),
+        "sfr": rng.lognormal(0, 1, nr_galaxies),
+        "stellarMass": rng.lognormal(0, 1, nr_galaxies),
+        "bulgeMass": rng.lognormal(-1, 1, nr_galaxies),
+        "hotGas": rng.lognormal(0, 1, nr_galaxies),
+        "coldGas": rng.lognormal(0, 1, nr_galaxies),
+        "metallicity": 10**rng.uniform(-5, -1.3, nr_galaxies)})
+    return catalog
+
+
+def makeTimeRelations():
+    """Generate a relation between the 64 snapshots and the lookback time.
+
+    Returns
+    -------
+    pandas DataFrame
+        The snapNum and lookbackTime (in Gyr) of each snapshot
+    """
+    return pd.DataFrame({"snapNum": np.arange(63, -1, -1),
+                         "lookbackTime": np.linspace(0, 13.5, 64)})
+
+
+def _time(func, repeats):
+    """Returns the best and mean time of **repeats** calls of **func**."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {"best": min(times), "mean": float(np.mean(times)), "repeats": repeats}
+
+
+def runBenchmarks(nr_galaxies=100000, sampling_rates=(100, 1000, 10000), repeats=3):
+    """Run all benchmarks.
+
+    Parameters
+    ----------
+    nr_galaxies : int
+        The size of the synthetic galaxy catalog
+    sampling_rates : array of ints
+        The sampling rates to time getEventRates at
+    repeats : int
+        The number of times each benchmark is run
+
+    Returns
+    -------
+    dict
+        The best and mean time in seconds of each benchmark
+    """
+    rng = np.random.default_rng(1)
+    results = {}
+
+    x = rng.uniform(0, 14, 1000000)
+    w = rng.random(1000000)
+    results["histogram.Fill (1e6 entries)"] = _time(lambda: kea.hist.histogram(0, 14, 1000).Fill(x, w), repeats)
+
+    DTD = kea.hist.BPASS_hist()
+    DTD.Fill(DTD.getLogBins(), 10**-DTD.getLogBins())
+    x1 = rng.uniform(0, 10, 100000)
+    x2 = x1 + rng.uniform(0.001, 5, 100000)
+    results["BPASS_hist.integral (1e3 scalar calls)"] = _time(
+        lambda: [DTD.integral(a, b) for a, b in zip(x1[:1000], x2[:1000])], repeats)
+    results["BPASS_hist.integral (1e5 pairs, vectorized)"] = _time(lambda: DTD.integral(x1, x2), repeats)
+
+    with tempfile.TemporaryDirectory() as folder:
+        data_folder = folder + "/"
+        writeBPASS(data_folder)
+        cache = folder + "/cache"
+        results["loadAllRates (no cache)"] = _time(lambda: kea.load.loadAllRates(data_folder, cache=False), repeats)
+        kea.load.loadAllRates(data_folder, cache=cache)
+        results["loadAllRates (warm cache)"] = _time(lambda: kea.load.loadAllRates(data_folder, cache=cache), repeats)
+        DTDs = kea.load.loadAllRates(data_folder, cache=False)["020"]
+
+    catalog = makeCatalog(nr_galaxies)
+    time_relations = makeTimeRelations()
+    results[f"getSFRD ({nr_galaxies} galaxies)"] = _time(
+        lambda: kea.rates.getSFRD(catalog, time_relations, 62.5, 0.73), repeats)
+
+    SFRD = kea.rates.getSFRD(catalog, time_relations, 62.5, 0.73)
+    SFR = interpolate.splrep(time_relations["lookbackTime"].values*1e9, SFRD, k=1)
+    for rate in sampling_rates:
+        for method in ["matrix", "fft"]:
+            def eventRates():
+                # time the resampling of the DTDs as well
+                kea.rates.DTD_cache.clear()
+                kea.rates.getEventRates(SFR, DTDs, rate, 13.5, method=method)
+            results[f"getEventRates (sampling_rate={rate}, {method})"] = _time(eventRates, repeats)
+
+    results[f"buildHistory ({nr_galaxies} galaxies)"] = _time(
+        lambda: kea.mergerHistory.buildHistory(catalog, verbose=False), repeats)
+    results[f"buildForest ({nr_galaxies} galaxies)"] = _time(
+        lambda: kea.mergerHistory.buildForest(catalog), repeats)
+
+    roots = kea.mergerHistory.buildHistory(catalog, verbose=False)
+    results[f"getSFR (all {len(roots)} roots)"] = _time(
+        lambda: [kea.mergerHistory.getSFR(i) for i in roots], repeats)
+    forest = kea.mergerHistory.buildForest(catalog)
+    results[f"MergerForest.getSFRs ({len(roots)} roots)"] = _time(lambda: forest.getSFRs(), repeats)
+
+    SFRs = forest.getSFRs(nr_snapshots=64)
+    kea.rates.DTD_cache.clear()
+    results[f"getGalaxyEventRates ({len(roots)} roots)"] = _time(
+        lambda: kea.rates.getGalaxyEventRates(SFRs, time_relations, DTDs, 1000, 13.5, chunk_size=1000), repeats)
+
+    return results
+
+
+def benchmark(output_file, nr_galaxies, sampling_rates, repeats, compare=None, profile=False):
+    if profile:
+        kea.profiling.enable()
+    results = runBenchmarks(nr_galaxies, sampling_rates, repeats)
+    out = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+           "platform": platform.platform(),
+           "python": platform.python_version(),
+           "numpy": np.__version__,
+           "results": results}
+    if profile:
+        out["profile"] = kea.profiling.getStats()
+    with open(output_file, "w") as f:
+        json.dump(out, f, indent=1)
+
+    previous = {}
+    if compare is not None:
+        with open(compare) as f:
+            previous = json.load(f)["results"]
+    for name in results:
+        line = f"{name:50s} {results[name]['best']*1e3:12.3f} ms"
+        if name in previous:
+            line += f"   ({previous[name]['best']/results[name]['best']:.2f}x)"
+        print(line)
+    if profile:
+        print()
+        print(kea.profiling.getReport())
+
+
+parser = argparse.ArgumentParser(description=__doc__,
+                                formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("-o",
+                    dest="output_file",
+                    type=str,
+                    default="benchmark.json",
+                    help="The JSON file to write the timings to"
+                    )
+
+parser.add_argument("-n",
+                    dest="nr_galaxies",
+                    type=int,
+                    default=100000,
+                    help="The number of galaxies in the synthetic catalog"
+                    )
+
+parser.add_argument("-s",
+                    dest="sampling_rates",
+                    type=int,
+                    nargs="+",
+                    default=[100, 1000, 10000],
+                    help="The sampling rates to time getEventRates at"
+                    )
+
+parser.add_argument("-r",
+                    dest="repeats",
+                    type=int,
+                    default=3,
+                    help="The number of times each benchmark is run"
+                    )
+
+parser.add_argument("-c",
+                    dest="compare",
+                    type=str,
+                    default=None,
+                    help="An earlier JSON output to compare the timings with"
+                    )
+
+parser.add_argument("-p",
+                    dest="profile",
+                    action="store_true",
+                    help="Profile the stages of kea and add them to the output"
+                    )
+parser.set_defaults(func=benchmark)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    benchmark(args.output_file, args.nr_galaxies, args.sampling_rates, args.repeats, args.compare, args.profile)
@@ -8,21 +8,25 @@ Author: Max Briel
 import pandas as pd
 import kea.mergerHistory as kea
 import numpy as np
-import pickle
 
 import argparse
 
-def buildMergerTree(data_folder, output_folder):
-    cosmod = pd.read_csv(data_folder+"large_galaxy.dat", comment="#")
-    root_nodes = kea.buildHistory(cosmod)
-    pickle.dump(root_nodes, open(output_folder+"mergertrees.p", "wb"))
+def buildMergerTree(data_folder, output_folder, chunksize=None):
+    if chunksize is None:
+        cosmod = pd.read_csv(data_folder+"large_galaxy.dat", comment="#")
+        forest = kea.buildForest(cosmod)
+        kea.saveForest(forest, output_folder+"mergertrees")
+    else:
+        # stream the trees: the trees of every chunk are written as soon as they are complete
+        chunks = pd.read_csv(data_folder+"large_galaxy.dat", comment="#", chunksize=chunksize)
+        with kea.ForestWriter(output_folder+"mergertrees") as writer:
+            kea.streamHistory(chunks, writer.write, forest=True)
 
 parser = argparse.ArgumentParser(description=__doc__,
                                 formatter_class=argparse.RawDescriptionHelpFormatter)
 parser.add_argument("-i",
                     dest="data_folder",
                     type=str,
-                    nargs=1,
                     required=True,
                     help="Folder containing the data files"
                     )
@@ -30,12 +34,19 @@ parser.add_argument("-i",
 parser.add_argument("-o",
                     dest="output_folder",
                     type=str,
-                    nargs=1,
                     required=True,
                     help="Output folder for plots"
                     )
+
+parser.add_argument("-c",
+                    dest="chunksize",
+                    type=int,
+                    default=None,
+                    help="Read the catalog in chunks of this many rows and "
+                         "write each tree as soon as it is complete."
+                    )
 parser.set_defaults(func=buildMergerTree)
 
 if __name__ == "__main__":
     args = parser.parse_args()
-    buildMergerTree(args.data_folder, args.output_folder)
+    buildMergerTree(args.data_folder, args.output_folder, args.chunksize)
@@ -0,0 +1,207 @@
+#
+# Tests for the histogram classes
+#
+#
+import numpy as np
+import pytest
+from kea.hist import histogram, BPASS_hist, histogramND, sumHistograms
+
+
+def test_fill_scalar():
+
+    x = histogram(0, 10, 10)
+    x.Fill(2.5, 2.0)
+    x.Fill(3.0)
+
+    assert x.getBinContent(2) == 2.0
+    assert x.getBinContent(3) == 1.0
+
+
+def test_fill_overflow():
+
+    x = histogram(0, 10, 10)
+    x.Fill(np.array([-1.0, 0.0, 10.0, 11.0]), 1.0)
+
+    assert x.getBinContent(0) == 2.0
+    assert x.getBinContent(9) == 2.0
+
+
+def test_fill_nan():
+
+    x = histogram(0, 10, 10)
+    with pytest.raises(Exception, match="NaN"):
+        x.Fill([1.0, np.nan])
+    assert x.getValues().sum() == 0
+
+
+def test_fill_weights():
+
+    x = histogram(0, 10, 10)
+    values = np.array([0.5, 0.5, 9.99, 4.0])
+    x.Fill(values, np.array([1.0, 2.0, 3.0, 4.0]))
+
+    assert np.allclose(x.getValues(), [3, 0, 0, 0, 4, 0, 0, 0, 0, 3])
+
+    with pytest.raises(Exception):
+        x.Fill(values, np.array([1.0, 2.0]))
+
+
+def test_BPASS_fill():
+
+    x = BPASS_hist()
+    log_bins = x.getLogBins()
+    x.Fill(log_bins, np.ones(len(log_bins)))
+
+    assert np.allclose(x.getValues(), np.ones(51))
+
+
+def test_integral():
+
+    x = histogram(0, 10, 10)
+    x.Fill(np.arange(10)+0.5, np.arange(10, dtype=float))
+
+    assert np.isclose(x.integral(0, 10), 45.0)
+    assert np.isclose(x.integral(2.5, 2.75), 0.5)
+    assert np.isclose(x.integral(1.5, 3.5), 0.5 + 2 + 1.5)
+    assert np.isclose(x.sum(1.5, 3.5), 0.5 + 2 + 1.5)
+
+    with pytest.raises(Exception):
+        x.integral(5, 4)
+
+
+def test_integral_arrays():
+
+    x = histogram(edges=[0, 1, 3, 6, 10])
+    x.Fill([0.5, 2, 4, 8], [1.0, 2.0, 3.0, 4.0])
+    x1 = np.array([0.0, 0.5, 2.0, 1.0])
+    x2 = np.array([10.0, 2.0, 7.0, 3.0])
+    expected = [x.integral(a, b) for a, b in zip(x1, x2)]
+
+    assert np.allclose(x.integral(x1, x2), expected)
+    assert np.allclose(x.sum(x1, x2), [x.sum(a, b) for a, b in zip(x1, x2)])
+
+
+def test_integral_after_fill():
+
+    x = histogram(0, 10, 10)
+    x.Fill(5.5, 1.0)
+    assert np.isclose(x.integral(0, 10), 1.0)
+
+    x.Fill(5.5, 1.0)
+    assert np.isclose(x.integral(0, 10), 2.0)
+    assert np.isclose((x*2).integral(0, 10), 4.0)
+
+
+def test_histogramND():
+
+    rng = np.random.default_rng(1)
+    x = rng.uniform(0, 10, 1000)
+    y = rng.uniform(-1, 1, 1000)
+    w = rng.uniform(0, 1, 1000)
+    hist = histogramND([(0, 10, 5), [-1, 0, 0.5, 1]])
+    hist.Fill(x, y, w=w)
+
+    expected, _ = np.histogramdd((x, y), bins=[np.linspace(0, 10, 6), [-1, 0, 0.5, 1]], weights=w)
+    assert hist.shape == (5, 3)
+    assert np.allclose(hist.getValues(), expected)
+
+    projection = hist.project(0)
+    assert isinstance(projection, histogram)
+    assert np.allclose(projection.getValues(), expected.sum(axis=1))
+    assert np.allclose(hist.getSlice(1, [2]).getValues(), expected[2])
+
+    assert np.isclose(hist.sum([None, None]), w.sum())
+    assert np.isclose(hist.integral([(0, 10), (0, 1)]), (expected[:, 1]*0.5 + expected[:, 2]*0.5).sum()*2)
+    assert np.isclose(hist.sum([(1, 3), None]), projection.sum(1, 3))
+
+
+def test_histogramND_overflow():
+
+    hist = histogramND([[0, 1, 2], [0, 1, 2], [0, 1]])
+    hist.Fill([-1, 5], [0.5, 3], [0.5, 0.5])
+
+    assert hist.getValues()[0, 0, 0] == 1
+    assert hist.getValues()[1, 1, 0] == 1
+    assert np.allclose(hist.getSlice(2, [None, 1]).getValues(), [1])
+
+
+def test_shared_binning():
+
+    x = BPASS_hist()
+    y = BPASS_hist()
+    assert x._binning is y._binning
+    assert histogram(0, 1, 10)._binning is histogram(edges=np.linspace(0, 1, 11))._binning
+
+    with pytest.raises(ValueError):
+        x.getBinEdges()[0] = 1.0
+
+
+def test_copy():
+
+    x = histogram(edges=[0, 1, 5])
+    x.Fill(0.5, 1.0)
+    y = x.copy()
+    y.Fill(0.5, 1.0)
+
+    assert np.allclose(y.getBinEdges(), [0, 1, 5])
+    assert x.getBinContent(0) == 1.0
+    assert y.getBinContent(0) == 2.0
+    assert isinstance(BPASS_hist().copy(), BPASS_hist)
+
+
+def test_arithmetic():
+
+    x = histogram(0, 4, 4)
+    x.Fill([0.5, 1.5, 2.5, 3.5], [1, 2, 3, 4])
+    y = histogram(0, 4, 4)
+    y.Fill([0.5, 1.5], [1, 1])
+
+    assert np.allclose((x + y).getValues(), [2, 3, 3, 4])
+    assert np.allclose((x - y).getValues(), [0, 1, 3, 4])
+    assert np.allclose((x * y).getValues(), [1, 2, 0, 0])
+    assert np.allclose((2*x/2).getValues(), x.getValues())
+    assert np.allclose(sum([x, y, y]).getValues(), [3, 4, 3, 4])
+    assert np.allclose((12/x).getValues(), [12, 6, 4, 3])
+    assert np.allclose((1 - x).getValues(), [0, -1, -2, -3])
+
+    # numpy operands defer to the histogram
+    scaled = np.array([1, 2, 3, 4])*x
+    assert isinstance(scaled, histogram)
+    assert np.allclose(scaled.getValues(), [1, 4, 9, 16])
+    assert isinstance(np.float64(2)*x, histogram)
+    assert isinstance(BPASS_hist() + BPASS_hist(), BPASS_hist)
+
+    with pytest.raises(Exception, match="different binnings"):
+        x + histogram(0, 4, 5)
+
+
+def test_inplace():
+
+    x = histogram(0, 4, 4)
+    x.Fill([0.5, 1.5, 2.5, 3.5], [1, 2, 3, 4])
+    values = x.getValues()
+    assert x.integral(0, 4) == 10
+
+    x *= 2
+    x += x
+    x /= np.array([1, 2, 4, 8])
+    x -= 1
+    assert x.getValues() is values
+    assert np.allclose(values, [3, 3, 2, 1])
+    # the cumulative tables are rebuilt after in-place changes
+    assert x.integral(0, 4) == 9
+
+
+def test_sumHistograms():
+
+    hists = [histogram(0, 2, 2) for i in range(3)]
+    for i, h in enumerate(hists):
+        h.Fill([0.5, 1.5], [i, 1])
+
+    assert np.allclose(sumHistograms(hists).getValues(), [3, 3])
+    assert np.allclose(sumHistograms(hists, weights=[1, 2, 3]).getValues(), [8, 6])
+
+    out = hists[1]
+    assert sumHistograms(hists, weights=[1, 2, 3], out=out) is out
+    assert np.allclose(out.getValues(), [8, 6])
+    assert np.allclose(hists[0].getValues(), [0, 1])
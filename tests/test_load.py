@@ -0,0 +1,157 @@
+#
+# Tests for loading the BPASS data
+#
+#
+import gzip
+import os
+import numpy as np
+import pytest
+import kea.load
+from kea.load import packnload, loadBPASS, loadGW, loadAllRates, setCache, clearCache
+
+metallicities = ["em5", "em4", "001","002", "003", "004", "006", "008", "010", "014", "020", "030", "040"]
+
+
+def _writeSNe(file, scale):
+    log_age = np.linspace(6, 11, 51)
+    with gzip.open(file, "wt") as f:
+        for i, age in enumerate(log_age):
+            row = [age] + [scale*(i+j) for j in range(16)] + [10**age]
+            f.write(" ".join(f"{x:.6E}" for x in row) + "\n")
+
+
+def _writeGW(file, scale):
+    log_age = np.linspace(6, 11, 51)
+    with open(file, "w") as f:
+        for i, age in enumerate(log_age):
+            f.write(f"{age:.2f} {scale*i:.6E} {scale*2*i:.6E} {scale*3*i:.6E} {10**age:.6E}\n")
+
+
+@pytest.fixture(autouse=True)
+def cache_folder(tmp_path):
+    folder = str(tmp_path / "cache")
+    settings = dict(kea.load._cache_settings)
+    setCache(folder=folder, enabled=True)
+    yield folder
+    kea.load._cache_settings.update(settings)
+
+
+@pytest.fixture
+def data_folder(tmp_path):
+    os.makedirs(tmp_path / "bpass_v2.2.1_imf135_300")
+    os.makedirs(tmp_path / "GWrates" / "v2.2hobbs")
+    for n, Z in enumerate(metallicities):
+        _writeSNe(tmp_path / "bpass_v2.2.1_imf135_300" / f"supernova-bin-imf135_300.z{Z}.dat.gz", n+1)
+        _writeGW(tmp_path / "GWrates" / "v2.2hobbs" / f"gwmergerdata.z{Z}.dat", n+1)
+    return str(tmp_path) + "/"
+
+
+def test_loadBPASS(data_folder):
+
+    rates = loadBPASS(data_folder+"bpass_v2.2.1_imf135_300/supernova-bin-imf135_300.z001.dat", ["ccsn", "Ia"])
+    widths = np.diff(rates["Ia"].getBinEdges())*1e9
+
+    assert np.allclose(rates["Ia"].getValues()*widths*1e6, 3*np.arange(51))
+    # IIP, II, Ib and Ic are columns 2 to 5
+    assert np.allclose(rates["ccsn"].getValues()*widths*1e6, 3*(4*np.arange(51) + 10))
+
+
+def test_loadGW(data_folder):
+
+    rates = loadGW(data_folder+"GWrates/v2.2hobbs/gwmergerdata.z001.dat", ["BHNS"])
+    widths = np.diff(rates["BHNS"].getBinEdges())*1e9
+
+    assert np.allclose(rates["BHNS"].getValues()*widths*1e6, 6*np.arange(51))
+
+
+def test_loadAllRates_workers(data_folder):
+
+    serial = loadAllRates(data_folder)
+    parallel = loadAllRates(data_folder, workers=2)
+
+    assert list(parallel) == metallicities
+    for Z in metallicities:
+        assert list(parallel[Z]) == list(serial[Z])
+        for t in serial[Z]:
+            assert np.allclose(parallel[Z][t].getValues(), serial[Z][t].getValues())
+
+
+def test_loadAllRates_errors(data_folder):
+
+    os.remove(data_folder+"GWrates/v2.2hobbs/gwmergerdata.z002.dat")
+
+    with pytest.raises(Exception, match="gwmergerdata.z002.dat"):
+        loadAllRates(data_folder, workers=2)
+
+
+def test_packnload(data_folder):
+
+    folder = data_folder+"bpass_v2.2.1_imf135_300/"
+    before = sorted(os.listdir(folder))
+    data = packnload(folder+"supernova-bin-imf135_300.z020.dat")
+
+    # no uncompressed copy is written next to the data
+    assert sorted(os.listdir(folder)) == before
+    assert len(data) == 51
+    assert list(data.columns[:8]) == ['log_age', 'Ia', 'IIP', 'II', 'Ib', 'Ic', 'LGRB', 'PISNe']
+    assert np.allclose(data["IIP"], 11*(np.arange(51)+1))
+
+
+def test_cache(data_folder, cache_folder):
+
+    file = data_folder+"GWrates/v2.2hobbs/gwmergerdata.z001.dat"
+    rates = loadGW(file, ["BHBH", "NSNS"])
+    assert len(os.listdir(cache_folder)) == 1
+
+    cached = loadGW(file, ["BHBH", "NSNS"])
+    assert list(cached) == ["BHBH", "NSNS"]
+    assert np.array_equal(cached["NSNS"].getValues(), rates["NSNS"].getValues())
+
+    # a changed file is read again
+    _writeGW(file, 10)
+    os.utime(file, ns=(0, 0))
+    changed = loadGW(file, ["BHBH", "NSNS"])
+    assert np.allclose(changed["NSNS"].getValues(), rates["NSNS"].getValues()*10)
+    assert len(os.listdir(cache_folder)) == 2
+
+    assert clearCache() == 2
+    assert os.listdir(cache_folder) == []
+
+
+def test_cache_failed_write(data_folder, cache_folder, monkeypatch):
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    file = data_folder+"GWrates/v2.2hobbs/gwmergerdata.z001.dat"
+    monkeypatch.setattr(os, "replace", fail)
+    rates = loadGW(file, ["BHBH"])
+    assert np.array_equal(rates["BHBH"].getValues(), loadGW(file, ["BHBH"], cache=False)["BHBH"].getValues())
+    assert os.listdir(cache_folder) == []
+
+    # files left behind by interrupted writes are cleared as well
+    open(os.path.join(cache_folder, "rates-interrupted.tmp"), "w").close()
+    assert clearCache() == 1
+    assert os.listdir(cache_folder) == []
+
+
+def test_cache_disabled(data_folder, cache_folder):
+
+    loadGW(data_folder+"GWrates/v2.2hobbs/gwmergerdata.z001.dat", ["BHBH"], cache=False)
+    setCache(enabled=False)
+    loadAllRates(data_folder)
+
+    assert not os.path.exists(cache_folder)
+
+
+def test_loadGW_format(tmp_path):
+
+    file = str(tmp_path / "gwmergerdata.z001.dat")
+    _writeGW(file, 1)
+    with open(file, "a") as f:
+        f.write("11.10 1 1 1 1\n")
+
+    with pytest.raises(Exception, match="Expected 51 rows"):
+        loadGW(file, ["BHBH"], cache=False)
+    with pytest.raises(Exception, match="Unknown"):
+        loadGW(file, ["BHXX"], cache=False)
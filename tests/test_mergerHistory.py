@@ -2,7 +2,11 @@
 # Test for the merger history tests
 #
 #
-from kea.mergerHistory import node, pprint_tree
+import pandas as pd
+import numpy as np
+import pytest
+from kea.mergerHistory import node, pprint_tree, buildHistory, buildForest, getSFR
+from kea.mergerHistory import iterTrees, iterTreeBatches, streamHistory, ForestWriter, saveForest, loadForest, loadTree
 
 def test_print():
 
@@ -35,3 +39,151 @@ def test_children():
     child2.addData(data)
 
     assert pprint_tree(root)  == None
+
+
+def _catalog():
+    # two trees in depth-first order: 0 <- (1 <- 2, 3), 4 <- 5
+    return pd.DataFrame({"galaxyID":     [0, 1, 2, 3, 4, 5],
+                         "descendantId": [-1, 0, 1, 0, -1, 4],
+                         "snapnum":      [63, 62, 61, 62, 63, 62],
+                         "sfr":          [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]})
+
+
+def _structure(item):
+    return (item.galaxyID, [_structure(i) for i in item.children])
+
+
+def test_buildHistory():
+
+    roots = buildHistory(_catalog())
+
+    assert [_structure(i) for i in roots] == [(0, [(1, [(2, [])]), (3, [])]), (4, [(5, [])])]
+    assert roots[0].children[0].parent is roots[0]
+    assert roots[0].data["sfr"] == 1.0
+
+
+def test_buildHistory_order():
+
+    catalog = _catalog()
+    shuffled = catalog.iloc[[5, 2, 3, 1, 4, 0]].reset_index(drop=True)
+    roots = buildHistory(shuffled)
+
+    assert [_structure(i) for i in roots] == [(4, [(5, [])]), (0, [(3, []), (1, [(2, [])])])]
+
+
+def test_buildForest():
+
+    forest = buildForest(_catalog())
+    roots = forest.getRoots()
+
+    assert len(forest) == 6
+    assert [_structure(i) for i in roots] == [(0, [(1, [(2, [])]), (3, [])]), (4, [(5, [])])]
+    assert roots[0].children[0].parent == roots[0]
+    assert roots[0].data["sfr"] == 1.0
+    assert list(forest.getIndex([5, 0])) == [5, 0]
+
+    shuffled = buildForest(_catalog().iloc[[5, 2, 3, 1, 4, 0]])
+    assert [_structure(i) for i in shuffled.getRoots()] == [(4, [(5, [])]), (0, [(3, []), (1, [(2, [])])])]
+
+
+def test_forest_SFRs():
+
+    forest = buildForest(_catalog())
+    SFRs = forest.getSFRs()
+
+    assert SFRs.shape == (2, 64)
+    for root, SFR in zip(forest.getRoots(), SFRs):
+        assert np.allclose(SFR, getSFR(root))
+
+    subtrees = forest.getSFRs(subtrees=True, nr_snapshots=70)
+    assert subtrees.shape == (6, 70)
+    for i in range(len(forest)):
+        assert np.allclose(subtrees[i], getSFR(forest.getNode(i), 70))
+
+    # snapshots beyond nr_snapshots would end up in another galaxy's row
+    with pytest.raises(Exception, match="nr_snapshots"):
+        forest.getSFRs(nr_snapshots=10)
+    with pytest.raises(Exception, match="nr_snapshots"):
+        forest.getSFRs(subtrees=True, nr_snapshots=10)
+
+
+def test_streamHistory():
+
+    catalog = _catalog()
+    chunks = [catalog.iloc[i:i+3] for i in range(0, len(catalog), 3)]
+
+    trees = list(iterTrees(chunks))
+    assert [list(i["galaxyID"]) for i in trees] == [[0, 1, 2, 3], [4, 5]]
+
+    roots = []
+    assert streamHistory(iter(chunks), roots.append) == 2
+    assert [_structure(i) for i in roots] == [_structure(i) for i in buildHistory(catalog)]
+
+    batches = list(iterTreeBatches(chunks))
+    assert [list(i["galaxyID"]) for i in batches] == [[0, 1, 2, 3], [4, 5]]
+    batches = list(iterTreeBatches([catalog.iloc[:5], catalog.iloc[5:]]))
+    assert [list(i["galaxyID"]) for i in batches] == [[0, 1, 2, 3], [4, 5]]
+    # the last tree is only complete at the end of the catalog
+    assert len(list(iterTreeBatches([catalog]))) == 2
+
+    forests = []
+    assert streamHistory([catalog.iloc[:5], catalog.iloc[5:]], forests.append, forest=True) == 2
+    assert [len(i) for i in forests] == [4, 2]
+
+    # the parallel build passes the same trees in the same order
+    roots = []
+    assert streamHistory(iter(chunks), roots.append, workers=2) == 2
+    assert [_structure(i) for i in roots] == [_structure(i) for i in buildHistory(catalog)]
+    parallel = []
+    assert streamHistory([catalog.iloc[:5], catalog.iloc[5:]], parallel.append, forest=True, workers=2) == 2
+    assert [list(i.galaxyID) for i in parallel] == [list(i.galaxyID) for i in forests]
+
+    with pytest.raises(Exception, match="not part of a tree"):
+        list(iterTreeBatches([catalog.iloc[1:]]))
+
+
+def test_forest_file(tmp_path):
+
+    folder = str(tmp_path / "forest")
+    forest = buildForest(_catalog().iloc[[5, 2, 3, 1, 4, 0]])
+    saveForest(forest, folder)
+
+    loaded = loadForest(folder)
+    assert sorted(_structure(i) for i in loaded.getRoots()) == sorted(_structure(i) for i in forest.getRoots())
+    # stored depth first
+    assert list(loaded.galaxyID) == [4, 5, 0, 3, 1, 2]
+
+    tree = loadTree(folder, 0)
+    assert [_structure(i) for i in tree.getRoots()] == [(0, [(3, []), (1, [(2, [])])])]
+    assert tree.getNode(3).data["sfr"] == 3.0
+
+    with pytest.raises(Exception):
+        loadTree(folder, 1)
+
+
+def test_forest_writer(tmp_path):
+
+    folder = str(tmp_path / "forest")
+    catalog = _catalog()
+    with ForestWriter(folder) as writer:
+        streamHistory([catalog], writer.write, forest=True)
+
+    assert [_structure(loadTree(folder, i).getRoots()[0]) for i in [0, 4]] == \
+        [_structure(i) for i in buildHistory(catalog)]
+    assert np.array_equal(loadForest(folder, mmap=False).getSFRs(), buildForest(catalog).getSFRs())
+
+
+def test_nested_set():
+
+    forest = buildForest(_catalog())
+    index = forest.getIndex([0, 1, 2, 3, 4, 5])
+
+    assert forest.isProgenitor(index[2], index[0])
+    assert forest.isProgenitor(index[2], index[1])
+    assert not forest.isProgenitor(index[3], index[1])
+    assert not forest.isProgenitor(index[0], index[0])
+    assert not forest.isProgenitor(index[5], index[0])
+    assert list(forest.isProgenitor(index[[1, 2, 3]], index[[0, 3, 0]])) == [True, False, True]
+
+    assert list(forest.galaxyID[forest.getProgenitors(index[0])]) == [1, 2, 3]
+    assert list(forest.getProgenitors(index[2])) == []
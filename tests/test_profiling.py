@@ -0,0 +1,85 @@
+#
+# Tests for the profiling and progress instrumentation
+#
+#
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import kea.profiling
+from kea.profiling import span, enable, reset, getStats, getReport
+from kea.mergerHistory import buildHistory, buildForest
+
+
+@pytest.fixture
+def profiling():
+    enabled = kea.profiling.isEnabled()
+    reset()
+    enable()
+    yield
+    enable(enabled)
+    reset()
+
+
+def _catalog(n):
+    return pd.DataFrame({"galaxyID": np.arange(n),
+                         "descendantId": np.where(np.arange(n) % 10 == 0, -1, np.arange(n)-1),
+                         "snapnum": 63 - np.arange(n) % 10,
+                         "sfr": np.ones(n)})
+
+
+def test_disabled():
+
+    enabled = kea.profiling.isEnabled()
+    enable(False)
+    reset()
+    with span("nothing", 10) as s:
+        s.items = 20
+    assert getStats() == {}
+    enable(enabled)
+
+
+def test_span(profiling):
+
+    for i in range(3):
+        with span("work", 10, "rows"):
+            pass
+    with span("other") as s:
+        s.items = 5
+    with span("untimed"):
+        pass
+
+    stats = getStats()
+    assert stats["work"]["calls"] == 3
+    assert stats["work"]["items"] == 30
+    assert stats["work"]["unit"] == "rows"
+    assert stats["other"]["items"] == 5
+    assert "rate" not in stats["untimed"]
+    assert json.loads(getReport("json")) == stats
+    assert "rows/s" in getReport()
+    with pytest.raises(Exception):
+        getReport("xml")
+
+
+def test_instrumented(profiling):
+
+    catalog = _catalog(2500)
+    buildHistory(catalog, verbose=False)
+    buildForest(catalog).getSFRs()
+
+    stats = getStats()
+    assert stats["tree build"]["items"] == 2500
+    assert stats["forest build"]["items"] == 2500
+    assert stats["SFR histories"]["unit"] == "nodes"
+
+
+def test_progress(capsys):
+
+    calls = []
+    buildHistory(_catalog(2500), progress=lambda done, total: calls.append((done, total)))
+    assert calls == [(0, 2500), (1000, 2500), (2000, 2500), (2500, 2500)]
+    # the callback replaces the printing
+    assert capsys.readouterr().out == ""
+
+    buildHistory(_catalog(1500))
+    assert capsys.readouterr().out.split() == ["0", "1000", "1500"]
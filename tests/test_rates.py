@@ -0,0 +1,211 @@
+#
+# Tests for the event rate calculations
+#
+#
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import interpolate
+from kea.hist import BPASS_hist
+from kea.rates import getSFRD, getMetallicitySFRD, getEventRates, getMetallicityEventRates
+import kea.rates
+from kea.rates import SFRHistory, DTDCache, getGalaxyEventRates
+
+
+def _DTDs():
+    DTDs = {}
+    log_bins = BPASS_hist().getLogBins()
+    for i, start in enumerate([6, 7.5]):
+        DTD = BPASS_hist()
+        DTD.Fill(log_bins, (log_bins >= start) * 10**(-log_bins + i))
+        DTDs[str(i)] = DTD
+    return DTDs
+
+
+def _SFR(now):
+    t = np.linspace(0, now, 30)
+    return interpolate.splrep(t*1e9, 0.01 + 0.05*np.exp(-(t-10)**2), k=1)
+
+
+def _loopEventRates(SFR, DTDs, sampling_rate, now):
+    # the straightforward triple loop over emission bins, lookback bins and types
+    lookback = np.linspace(0, now, sampling_rate+1)
+    events = {d: np.zeros(sampling_rate) for d in DTDs}
+    for i in range(1, sampling_rate+1):
+        mass = interpolate.splint(lookback[i-1]*1e9, lookback[i]*1e9, SFR)
+        for j in range(0, i):
+            for d in DTDs:
+                p1 = lookback[i] - lookback[j]
+                p2 = lookback[i] - lookback[j+1]
+                events[d][j] += DTDs[d].integral(p2, p1)*mass
+    return {d: events[d]/(np.diff(lookback)*1e9) for d in events}
+
+
+@pytest.mark.parametrize("method", ["matrix", "fft"])
+def test_event_rates(method):
+
+    now = 13.799
+    DTDs = _DTDs()
+    SFR = _SFR(now)
+    expected = _loopEventRates(SFR, DTDs, 40, now)
+    events = getEventRates(SFR, DTDs, 40, now, method=method)
+
+    for d in DTDs:
+        assert np.allclose(events[d].getValues(), expected[d], rtol=1e-10, atol=0)
+
+
+def test_metallicity_event_rates():
+
+    now = 13.799
+    DTDs = {"001": _DTDs(), "020": _DTDs()}
+    DTDs["020"]["1"] = DTDs["020"]["1"]*3
+    SFRs = {"001": _SFR(now), "020": _SFR(now)}
+
+    events, events_per_Z = getMetallicityEventRates(SFRs, DTDs, 40, now)
+
+    for Z in SFRs:
+        expected = getEventRates(SFRs[Z], DTDs[Z], 40, now)
+        for d in expected:
+            assert np.allclose(events_per_Z[Z][d].getValues(), expected[d].getValues())
+
+    for d in events:
+        total = events_per_Z["001"][d].getValues() + events_per_Z["020"][d].getValues()
+        assert np.allclose(events[d].getValues(), total)
+
+
+def test_SFRD():
+
+    simulation = pd.DataFrame({"snapnum": [1, 1, 2, 4, 4, 4],
+                               "sfr": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+                               "type": [0, 1, 0, 0, 1, 1]})
+    time_relations = pd.DataFrame({"snapNum": [4, 3, 2, 1, 0]})
+
+    SFRD = getSFRD(simulation, time_relations, 2.0, 1.0)
+    assert np.allclose(SFRD, np.array([15, 0, 3, 3, 0])/8)
+
+    SFRDs = getSFRD(simulation, time_relations, 2.0, 1.0, groupby="type")
+    assert np.allclose(SFRDs[0], np.array([4, 0, 3, 1, 0])/8)
+    assert np.allclose(SFRDs[1], np.array([11, 0, 0, 2, 0])/8)
+
+    # snapshots missing from time_relations are ignored
+    extra = pd.DataFrame({"snapnum": [-1, 7], "sfr": [10.0, 20.0], "type": [0, 1]})
+    simulation = pd.concat([simulation, extra], ignore_index=True)
+    assert np.allclose(getSFRD(simulation, time_relations, 2.0, 1.0), SFRD)
+    assert np.allclose(getSFRD(simulation, time_relations, 2.0, 1.0, groupby="type")[1], SFRDs[1])
+
+
+def test_metallicity_SFRD():
+
+    simulation = pd.DataFrame({"snapnum": [1, 1, 2, 2, 0],
+                               "sfr": [1.0, 2.0, 3.0, 4.0, 5.0],
+                               "metallicity": [0.02, 0.021, 0.0, 0.0012, 0.1]})
+    time_relations = pd.DataFrame({"snapNum": [2, 1, 0]})
+
+    SFRD = getMetallicitySFRD(simulation, time_relations, 1.0, 1.0)
+
+    assert list(SFRD)[0] == "em5" and len(SFRD) == 13
+    assert np.allclose(SFRD["020"], [0, 3, 0])
+    assert np.allclose(SFRD["em5"], [3, 0, 0])
+    assert np.allclose(SFRD["001"], [4, 0, 0])
+    assert np.allclose(SFRD["040"], [0, 0, 5])
+    assert np.allclose(sum(SFRD.values()), getSFRD(simulation, time_relations, 1.0, 1.0))
+
+    # snapshots missing from time_relations are ignored
+    extra = pd.DataFrame({"snapnum": [-1, 3], "sfr": [10.0, 20.0], "metallicity": [0.02, 0.02]})
+    simulation = pd.concat([simulation, extra], ignore_index=True)
+    shifted = getMetallicitySFRD(simulation, time_relations, 1.0, 1.0)
+    for Z in SFRD:
+        assert np.allclose(shifted[Z], SFRD[Z])
+
+    # galaxies without a metallicity are ignored
+    extra = pd.DataFrame({"snapnum": [2, 1], "sfr": [10.0, 20.0], "metallicity": [np.nan, np.nan]})
+    simulation = pd.concat([simulation, extra], ignore_index=True)
+    missing = getMetallicitySFRD(simulation, time_relations, 1.0, 1.0)
+    for Z in SFRD:
+        assert np.allclose(missing[Z], SFRD[Z])
+
+
+def test_SFRHistory():
+
+    now = 13.799
+    SFR = _SFR(now)
+    history = SFRHistory(SFR)
+    edges = np.linspace(-1, now+1, 50)
+
+    expected = [interpolate.splint(t1*1e9, t2*1e9, SFR) for t1, t2 in zip(edges[:-1], edges[1:])]
+    masses = history.getBinMasses(edges)
+    assert np.allclose(masses, expected, rtol=1e-10)
+    assert history.getBinMasses(edges) is masses
+    assert np.isclose(history.integral(1e9, 2e9), interpolate.splint(1e9, 2e9, SFR))
+
+    events = getEventRates(history, _DTDs(), 40, now)
+    expected = getEventRates(SFR, _DTDs(), 40, now)
+    for d in events:
+        assert np.allclose(events[d].getValues(), expected[d].getValues())
+
+
+def test_DTD_cache():
+
+    cache = DTDCache(max_bytes=2*8*40)
+    DTDs = _DTDs()
+    edges = np.linspace(0, 13.799, 41)
+
+    first = cache.resample(DTDs["0"], edges)
+    assert np.allclose(first, DTDs["0"].integral(edges[:-1], edges[1:]))
+    assert cache.resample(DTDs["0"].copy(), edges) is first
+    assert cache.getStats()["hits"] == 1
+
+    # changed content is a new entry
+    changed = cache.resample(DTDs["0"]*2, edges)
+    assert np.allclose(changed, first*2)
+
+    # the oldest entry is dropped to stay within max_bytes
+    cache.resample(DTDs["1"], edges)
+    assert cache.getStats() == {"hits": 1, "misses": 3, "entries": 2, "bytes": 2*8*40}
+    cache.resample(DTDs["0"], edges)
+    assert cache.getStats()["misses"] == 4
+
+
+@pytest.mark.parametrize("method", ["matrix", "fft"])
+def test_galaxy_event_rates(method):
+
+    now = 13.799
+    DTDs = _DTDs()
+    time_relations = pd.DataFrame({"snapNum": np.arange(9, -1, -1),
+                                   "lookbackTime": np.linspace(0, 13, 10)})
+    SFRs = np.random.default_rng(1).random((7, 10))
+
+    events = getGalaxyEventRates(SFRs, time_relations, DTDs, 40, now, method=method)
+    assert events.shape == (7, 2, 40)
+    for g in range(7):
+        SFR = interpolate.splrep(time_relations["lookbackTime"]*1e9,
+                                 SFRs[g][time_relations["snapNum"]], k=1)
+        expected = getEventRates(SFR, DTDs, 40, now)
+        for j, d in enumerate(DTDs):
+            values = expected[d].getValues()
+            assert np.allclose(events[g, j], values, rtol=1e-10, atol=1e-12*values.max())
+
+    out = np.zeros((7, 2, 40))
+    chunked = getGalaxyEventRates(SFRs, time_relations, DTDs, 40, now, method=method,
+                                  chunk_size=3, out=out)
+    assert chunked is out
+    assert np.allclose(chunked, events)
+
+
+def test_galaxy_event_rates_memory(monkeypatch):
+
+    # with small Hankel blocks, the memory use only grows linearly with the
+    # number of bins: a (types x bins x bins) matrix would take 64 MB here
+    monkeypatch.setattr(kea.rates, "_block_elements", 2**16)
+    time_relations = pd.DataFrame({"snapNum": np.arange(9, -1, -1),
+                                   "lookbackTime": np.linspace(0, 13, 10)})
+    SFRs = np.random.default_rng(1).random((8, 10))
+
+    tracemalloc.start()
+    events = getGalaxyEventRates(SFRs, time_relations, _DTDs(), 2000, 13.799, chunk_size=2)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert events.shape == (8, 2, 2000)
+    assert peak < 8*2**20